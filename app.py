@@ -11,7 +11,7 @@ Características:
 - Historial conversacional (últimas 5 interacciones)
 - Retrieval con similarity_search (k=5-10)
 - Logging completo con tokens y costos
-- Endpoints: /chat, /vote, /feedback, /metrics, /vectorize
+- Endpoints: /chat, /chat/stream (SSE), /vote, /feedback, /metrics, /vectorize
 
 Base de datos: labia_db
 Colección: labia_embeddings
@@ -26,14 +26,24 @@ Fecha: 27 de diciembre de 2025
 import grpc_config
 
 import os
+import atexit
+import decimal
 import time
 import uuid
 import ssl
-import httpx
+import threading
+import functools
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
+import orjson
+import numpy as np
+from cachetools import TTLCache
 from datetime import datetime
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+from sqlalchemy import create_engine
 
 # LangChain con Google Gemini
 from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
@@ -60,13 +70,34 @@ ssl_context = ssl.create_default_context()
 ssl_context.check_hostname = False
 ssl_context.verify_mode = ssl.CERT_NONE
 
-httpx_client = httpx.Client(verify=False, timeout=60.0)
-
 # Deshabilitar warnings de SSL
 import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+def _orjson_default(obj):
+    """Tipos que orjson no serializa de forma nativa (p.ej. NUMERIC de PostgreSQL)."""
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    raise TypeError(f"Tipo no serializable a JSON: {type(obj).__name__}")
+
+
+class ORJSONProvider(JSONProvider):
+    """
+    Proveedor JSON de Flask basado en orjson.
+    
+    Serializa más rápido que el módulo json estándar (sobre todo texto en español con
+    acentos) y soporta datetime de forma nativa. Lo usan jsonify() y request.get_json().
+    """
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=_orjson_default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 CORS(app)  # Habilitar CORS para todas las rutas
 
 # Inicializar Base de Datos
@@ -98,6 +129,24 @@ print("=" * 80 + "\n")
 
 COLLECTION_NAME = "labia_embeddings"
 RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "5"))  # Número de documentos a recuperar
+DOC_COUNT_TTL = int(os.getenv("DOC_COUNT_TTL", "60"))  # Segundos que /metrics reutiliza el conteo
+
+# Pool de hilos para las etapas independientes de /chat (sesión, historial, retrieval)
+chat_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("CHAT_EXECUTOR_WORKERS", "8")),
+    thread_name_prefix="chat"
+)
+
+# Caché de retrieval (preguntas repetidas o casi idénticas)
+RETRIEVAL_CACHE_TTL = int(os.getenv("RETRIEVAL_CACHE_TTL", "600"))  # Segundos
+SEMANTIC_CACHE_SIZE = 256  # Últimas preguntas comparadas por similitud
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.97"))  # Coseno mínimo
+
+# Versión del corpus (tabla corpus_state, la incrementa cada ingesta, sea por /vectorize o
+# por `python ingest.py`): invalida los cachés de conteo y retrieval en todos los workers.
+# Se relee de PG como máximo cada CORPUS_VERSION_TTL segundos.
+CORPUS_VERSION_TTL = float(os.getenv("CORPUS_VERSION_TTL", "5"))
+_corpus_version = (0, float("-inf"))  # (versión, time.monotonic() de la última lectura)
 
 # PostgreSQL Connection String
 PG_CONNECTION_STRING = f"postgresql://{os.getenv('POSTGRES_USER', 'postgres')}:{os.getenv('POSTGRES_PASSWORD', '')}@{os.getenv('POSTGRES_HOST', 'localhost')}:{os.getenv('POSTGRES_PORT', '5432')}/{os.getenv('POSTGRES_DB', 'labia_db')}"
@@ -107,27 +156,37 @@ PG_CONNECTION_STRING = f"postgresql://{os.getenv('POSTGRES_USER', 'postgres')}:{
 # ================================================================================================
 
 print("🔗 Conectando a Google Gemini Embeddings...")
-# Cliente httpx customizado para bypass SSL y DNS
-httpx_client_embeddings = httpx.Client(
-    verify=False,
-    timeout=120.0,
-    follow_redirects=True
-)
-
 embeddings = GoogleGenerativeAIEmbeddings(
     model="models/embedding-001",
     google_api_key=os.getenv("GOOGLE_API_KEY"),
     transport="rest",  # Forzar REST (no gRPC)
-    client_options={"api_endpoint": "https://generativelanguage.googleapis.com"},
-    client=httpx_client_embeddings  # Bypass SSL y DNS issues
+    client_options={"api_endpoint": "https://generativelanguage.googleapis.com"}
+    # Sin client=: GoogleGenerativeAIEmbeddings lo reemplaza siempre por su propio cliente
 )
 
 print(f"🗄️  Conectando a PostgreSQL+pgvector (colección: {COLLECTION_NAME})...")
+# Engine con pool de conexiones: cada similarity_search reutiliza una sesión ya abierta.
+# hnsw.ef_search se fija por sesión para el índice HNSW (ver database.ensure_embedding_indexes)
+vector_engine = create_engine(
+    PG_CONNECTION_STRING,
+    pool_size=database.PG_POOL_MIN,
+    max_overflow=database.PG_POOL_MAX - database.PG_POOL_MIN,
+    pool_pre_ping=True,
+    connect_args={
+        "options": f"-c statement_timeout={database.PG_STATEMENT_TIMEOUT_MS} -c hnsw.ef_search={database.HNSW_EF_SEARCH}"
+    }
+)
+
 vectorstore = PGVector(
-    connection=PG_CONNECTION_STRING,
+    connection=vector_engine,
     collection_name=COLLECTION_NAME,
-    embeddings=embeddings
+    embeddings=embeddings,
+    embedding_length=database.EMBEDDING_DIMENSIONS
 )
+try:
+    database.ensure_embedding_indexes()
+except Exception as e:
+    print(f"❌ No se pudieron crear los índices de embeddings (búsquedas sin HNSW): {e}")
 
 # ================================================================================================
 # INICIALIZACIÓN DEL LLM (GOOGLE GEMINI)
@@ -188,8 +247,13 @@ INSTRUCCIONES CRÍTICAS:
    
    Es importante calibrar el pH-metro antes de cada serie de mediciones y verificar que la muestra 
    esté homogénea para obtener lecturas representativas."
+"""
 
-CONTEXTO DE INSTRUCTIVOS DISPONIBLES:
+# Parte dinámica del prompt (cambia en cada request). Va DESPUÉS del bloque estático
+# para que el prefijo (SYSTEM_PROMPT) sea idéntico entre llamadas y Gemini lo aproveche
+# con su caché implícito. No se usa caché explícito (CachedContent): el SYSTEM_PROMPT
+# (~500 tokens) no alcanza el mínimo de 1024 tokens que Gemini exige para crearlo.
+HUMAN_PROMPT = """CONTEXTO DE INSTRUCTIVOS DISPONIBLES:
 {context}
 
 HISTORIAL DE CONVERSACIÓN:
@@ -199,18 +263,26 @@ PREGUNTA DEL TÉCNICO:
 {question}
 """
 
+# Plantillas y cadenas compiladas una sola vez (no por request)
+FULL_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", SYSTEM_PROMPT),
+    ("human", HUMAN_PROMPT)
+])
+FULL_CHAIN = FULL_PROMPT | llm
+
 # ================================================================================================
 # FUNCIONES AUXILIARES
 # ================================================================================================
 
-def calculate_tokens_gemini(text: str) -> int:
+def calculate_tokens_gemini(*texts: str) -> int:
     """
     Estima tokens para Google Gemini.
     Aproximación: ~1 token ≈ 4 caracteres para texto en español.
     
-    Para cálculo exacto, usar la API de Gemini (futura mejora).
+    Acepta varios textos y suma sus longitudes (sin concatenarlos en un string nuevo).
+    Solo se usa como respaldo: el conteo exacto viene en usage_metadata de la respuesta.
     """
-    return len(text) // 4
+    return sum(map(len, texts)) // 4
 
 
 def format_chat_history(history_tuples: list) -> str:
@@ -234,6 +306,453 @@ def format_chat_history(history_tuples: list) -> str:
     
     return "\n".join(formatted)
 
+
+HISTORY_TURNS = database.HISTORY_LIMIT  # Interacciones previas que entran en el prompt
+
+
+def get_session_history(session_id: str) -> list:
+    """
+    Devuelve el historial reciente [(user_query, bot_response), ...] de la sesión.
+    
+    Se lee de PG en cada turno (una fila por clave primaria en chat_session_state): con
+    varios workers de gunicorn, la fila es la única copia que ve los turnos servidos por
+    todos ellos y los /clear_session de cualquiera.
+    """
+    if not session_id:
+        return []
+    return database.get_recent_history(session_id, HISTORY_TURNS)
+
+
+class EmbeddingMicroBatcher:
+    """
+    Agrupa los embeddings de preguntas concurrentes en una sola llamada a Gemini.
+    
+    Cada request encola su texto y espera un Future; un hilo recolector junta lo que
+    llegue dentro de una ventana corta (o hasta max_batch textos) y hace UNA llamada
+    embed_documents para todo el lote. Con N requests simultáneos se paga un solo
+    round-trip HTTPS en lugar de N.
+    
+    El hilo se inicia en el primer uso, así cada worker de gunicorn tiene el suyo.
+    """
+
+    def __init__(self, embeddings_model, window_seconds: float = 0.03, max_batch: int = 16):
+        self._embeddings = embeddings_model
+        self._window = window_seconds
+        self._max_batch = max_batch
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    def embed(self, text: str) -> list:
+        """Devuelve el embedding de una pregunta (bloquea hasta que su lote se resuelva)."""
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((text, future))
+        return future.result()
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            with self._worker_lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(
+                        target=self._run, daemon=True, name="embedding-micro-batcher"
+                    )
+                    self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self._window
+            while len(batch) < self._max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                vectors = self._embeddings.embed_documents(
+                    [text for text, _ in batch],
+                    task_type="RETRIEVAL_QUERY"  # Mismo task_type que embed_query
+                )
+                for (_, future), vector in zip(batch, vectors):
+                    future.set_result(vector)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+
+query_embedder = EmbeddingMicroBatcher(
+    embeddings,
+    window_seconds=float(os.getenv("EMBED_BATCH_WINDOW_MS", "30")) / 1000,
+    max_batch=int(os.getenv("EMBED_BATCH_MAX", "16"))
+)
+
+
+def normalize_query(text: str) -> str:
+    """Normaliza la pregunta (espacios colapsados, casefold) para maximizar aciertos de caché."""
+    return " ".join(text.split()).casefold()
+
+
+@functools.lru_cache(maxsize=2048)
+def embed_query_cached(normalized_query: str) -> tuple:
+    """
+    Embedding de la pregunta con caché LRU en memoria.
+    
+    Las preguntas repetidas evitan el round-trip HTTPS a Gemini Embeddings; los fallos
+    de caché concurrentes se agrupan en un solo request (EmbeddingMicroBatcher).
+    Se devuelve una tupla (inmutable) porque el mismo objeto se comparte entre requests.
+    """
+    return tuple(query_embedder.embed(normalized_query))
+
+
+class SemanticQueryCache:
+    """
+    Caché semántico de retrieval: reutiliza los documentos de una pregunta reciente
+    cuyo embedding sea casi idéntico (coseno >= threshold) al de la pregunta actual.
+    
+    Guarda los últimos max_entries vectores normalizados en un buffer circular de NumPy;
+    la búsqueda es un producto matriz-vector (sub-milisegundo para 256 x 768).
+    Las entradas con más de ttl segundos se ignoran (red de seguridad si la versión
+    del corpus no llega a cambiar).
+    """
+
+    def __init__(self, max_entries: int = 256, threshold: float = 0.97, ttl: float = 600):
+        self._max_entries = max_entries
+        self._threshold = threshold
+        self._ttl = ttl
+        self._vectors = None  # np.ndarray (max_entries, dim), se crea con el primer vector
+        self._stored_at = np.zeros(max_entries)  # time.monotonic() de cada entrada
+        self._docs = [None] * max_entries
+        self._size = 0
+        self._next = 0
+        self._version = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    def get(self, vector, version: int):
+        """Devuelve los documentos cacheados más similares, o None si ninguno supera el umbral."""
+        v = self._normalize(vector)
+        with self._lock:
+            if self._version != version or self._size == 0:
+                return None
+            similarities = self._vectors[:self._size] @ v
+            similarities[self._stored_at[:self._size] < time.monotonic() - self._ttl] = -1.0
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self._threshold:
+                return self._docs[best]
+        return None
+
+    def put(self, vector, docs: list, version: int):
+        v = self._normalize(vector)
+        with self._lock:
+            if self._version != version or self._vectors is None:
+                # Corpus nuevo: descartar todo lo anterior
+                self._vectors = np.zeros((self._max_entries, v.shape[0]), dtype=np.float32)
+                self._docs = [None] * self._max_entries
+                self._size = 0
+                self._next = 0
+                self._version = version
+            self._vectors[self._next] = v
+            self._docs[self._next] = docs
+            self._stored_at[self._next] = time.monotonic()
+            self._next = (self._next + 1) % self._max_entries
+            self._size = min(self._size + 1, self._max_entries)
+
+
+# Nivel 1: coincidencia exacta (pregunta normalizada) → evita embedding y búsqueda
+retrieval_cache = TTLCache(maxsize=1024, ttl=RETRIEVAL_CACHE_TTL)
+retrieval_cache_lock = threading.Lock()
+# Nivel 2: similitud semántica con preguntas recientes → evita la búsqueda en pgvector
+semantic_cache = SemanticQueryCache(SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD, RETRIEVAL_CACHE_TTL)
+
+
+def get_corpus_version(refresh: bool = False) -> int:
+    """
+    Versión del corpus compartida entre procesos (database.get_corpus_version).
+    
+    Cacheada CORPUS_VERSION_TTL segundos para no sumar una consulta a cada /chat; si PG
+    falla se conserva la última versión conocida y se reintenta en la siguiente ventana.
+    """
+    global _corpus_version
+    version, read_at = _corpus_version
+    now = time.monotonic()
+    if not refresh and now - read_at < CORPUS_VERSION_TTL:
+        return version
+    try:
+        version = database.get_corpus_version(COLLECTION_NAME)
+    except Exception as e:
+        print(f"⚠️  No se pudo leer la versión del corpus: {e}")
+    _corpus_version = (version, now)
+    return version
+
+
+def retrieve_documents(user_query: str) -> list:
+    """
+    Retrieval (RAG): embedding de la pregunta (cacheado) + búsqueda semántica.
+    
+    Antes de ir a Gemini/pgvector consulta dos niveles de caché (exacto y semántico),
+    ambos ligados a la versión del corpus para que una re-ingesta los invalide.
+    
+    Returns:
+        Lista de Documents (vacía si el vectorstore falla)
+    """
+    normalized_query = normalize_query(user_query)
+    version = get_corpus_version()
+    cache_key = (version, normalized_query)
+
+    with retrieval_cache_lock:
+        docs = retrieval_cache.get(cache_key)
+    if docs is not None:
+        return docs
+
+    try:
+        query_vector = embed_query_cached(normalized_query)
+        docs = semantic_cache.get(query_vector, version)
+        if docs is None:
+            docs = vectorstore.similarity_search_by_vector(list(query_vector), k=RETRIEVAL_K)
+            semantic_cache.put(query_vector, docs, version)
+    except Exception as e:
+        print(f"❌ Error en vectorstore: {e}")
+        return []
+
+    with retrieval_cache_lock:
+        retrieval_cache[cache_key] = docs
+    return docs
+
+
+@functools.lru_cache(maxsize=1)
+def _count_collection_docs(time_bucket: int, version: int) -> int:
+    """
+    Cuenta los embeddings de la colección.
+    
+    Cacheado por (ventana de DOC_COUNT_TTL segundos, versión del corpus): dentro de la
+    misma ventana /metrics no vuelve a consultar PostgreSQL. Los errores no se cachean.
+    """
+    with database.pg_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT COUNT(*) FROM langchain_pg_embedding WHERE collection_id = (SELECT uuid FROM langchain_pg_collection WHERE name = %s)",
+            (COLLECTION_NAME,)
+        )
+        return cursor.fetchone()[0] or 0
+
+
+def get_doc_count() -> int:
+    """Conteo de documentos vectorizados (cacheado, ver _count_collection_docs)."""
+    return _count_collection_docs(int(time.time() // DOC_COUNT_TTL), get_corpus_version())
+
+
+def invoke_llm(variables: dict):
+    """
+    Invoca Gemini con el prompt completo (SYSTEM_PROMPT fijo + parte dinámica).
+    
+    Args:
+        variables: Dict con 'context', 'chat_history' y 'question'
+    
+    Returns:
+        AIMessage con la respuesta del modelo
+    """
+    return FULL_CHAIN.invoke(variables)
+
+
+def stream_llm(variables: dict):
+    """Versión streaming de invoke_llm: genera AIMessageChunk a medida que Gemini responde."""
+    yield from FULL_CHAIN.stream(variables)
+
+# ================================================================================================
+# PIPELINE DE UN TURNO DE CHAT (compartido por /chat y /chat/stream)
+# ================================================================================================
+
+LLM_ERROR_MESSAGE = "Lo siento, ha ocurrido un error al procesar tu solicitud. Por favor, intenta de nuevo."
+
+
+def prepare_turn(user_query: str, session_id: str) -> dict:
+    """
+    Etapas previas al LLM: historial, retrieval y armado del contexto.
+    
+    Returns:
+        Dict con 'variables' (entrada del prompt), 'sources', 'context_docs_json',
+        'user_query' y 'session_id'
+    """
+    # 1-2. En paralelo (son independientes hasta armar el prompt):
+    #   1. Recuperar historial de conversación (últimas 5 interacciones)
+    #   2. Retrieval (RAG) - Búsqueda semántica
+    # El estado de la sesión se actualiza junto con el log en finalize_turn (record_turn)
+    f_history = chat_executor.submit(get_session_history, session_id)
+    docs = retrieve_documents(user_query)
+    history_tuples = f_history.result()
+
+    formatted_history = format_chat_history(history_tuples)
+
+    # Construir contexto, fuentes únicas (en orden de relevancia) y resumen para el log
+    # en una sola pasada sobre los documentos
+    context_parts = []
+    seen_sources = {}
+    context_docs_json = []
+    for d in docs:
+        # .get(): filas ingestadas antes de que ingest.py fijara todas las claves
+        # (p.ej. tablas sin 'seccion') siguen en la colección
+        m = d.metadata
+        context_parts.append(f"[{m.get('codigo_documento', 'DOC')}] {d.page_content}")
+        seen_sources.setdefault(m.get('source', 'Desconocido'), None)
+        if len(context_docs_json) < 3:  # Solo primeros 3 para JSON
+            context_docs_json.append({
+                "source": m.get('source'),
+                "codigo": m.get('codigo_documento'),
+                "seccion": m.get('seccion')
+            })
+
+    return {
+        "user_query": user_query,
+        "session_id": session_id,
+        "variables": {
+            "context": "\n\n".join(context_parts),
+            "chat_history": formatted_history,
+            "question": user_query
+        },
+        "sources": list(seen_sources),
+        "context_docs_json": context_docs_json
+    }
+
+
+def finalize_turn(turn: dict, bot_response: str, usage, start_time: float) -> dict:
+    """
+    Etapas posteriores al LLM: conteo de tokens y logging en base de datos.
+    
+    Args:
+        turn: Resultado de prepare_turn()
+        bot_response: Respuesta completa del asistente
+        usage: usage_metadata de Gemini (None si no está disponible)
+        start_time: Inicio del request (time.time())
+    
+    Returns:
+        Dict con sources, log_id, latency, session_id, tokens y costo
+    """
+    latency = time.time() - start_time
+    variables = turn["variables"]
+
+    # 5. Tokens: conteo exacto reportado por Gemini (usage_metadata, sin costo extra)
+    if usage:
+        tokens_in = usage["input_tokens"]
+        tokens_out = usage["output_tokens"]
+    else:
+        # Respaldo (p.ej. error del LLM): estimación sobre las partes del prompt
+        tokens_in = calculate_tokens_gemini(
+            SYSTEM_PROMPT, variables['context'], variables['chat_history'], variables['question']
+        )
+        tokens_out = calculate_tokens_gemini(bot_response)
+
+    # 6. Logging en base de datos (log + estado de sesión en una sola transacción)
+    log_id = database.record_turn(
+        tokens_in=tokens_in,
+        tokens_out=tokens_out,
+        latency=latency,
+        user_query=turn["user_query"],
+        bot_response=bot_response,
+        session_id=turn["session_id"],
+        context_docs=turn["context_docs_json"]
+    )
+
+    return {
+        "sources": turn["sources"],
+        "log_id": log_id,
+        "latency": round(latency, 2),
+        "session_id": turn["session_id"],
+        "tokens_in": tokens_in,
+        "tokens_out": tokens_out,
+        "cost_usd": round(database.cost_nanousd(tokens_in, tokens_out) / 1e9, 6)
+    }
+
+# ================================================================================================
+# ESCRITURA DIFERIDA DE FEEDBACK
+# ================================================================================================
+
+class FeedbackWriter:
+    """
+    Escribe los feedbacks negativos en segundo plano y por lotes.
+    
+    El endpoint solo encola el registro y responde; un hilo drena la cola cada
+    flush_seconds e inserta todo lo pendiente en una sola transacción. Si el lote falla
+    (p.ej. un chat_log_id que no existe rompe la FK), se reintenta fila por fila para que
+    solo se pierdan las filas inválidas. Al cerrar el proceso (atexit) se vacía la cola y
+    se espera el lote que el hilo tenga en curso.
+    
+    El hilo se inicia en el primer uso, así cada worker de gunicorn tiene el suyo.
+    """
+
+    def __init__(self, flush_seconds: float = 0.2, exit_timeout: float = 10.0):
+        self._flush_seconds = flush_seconds
+        self._exit_timeout = exit_timeout
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._pending = 0  # Encolados y todavía no escritos (incluye el lote en curso)
+        self._pending_cond = threading.Condition()
+        atexit.register(self.flush)
+
+    def put(self, chat_log_id, comment, source, response):
+        self._ensure_worker()
+        with self._pending_cond:
+            self._pending += 1
+        self._queue.put((chat_log_id, datetime.now(), comment, source, response))
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            with self._worker_lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(
+                        target=self._run, daemon=True, name="feedback-writer"
+                    )
+                    self._worker.start()
+
+    def _drain(self, batch: list) -> list:
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                return batch
+
+    def _write(self, batch: list):
+        try:
+            try:
+                database.save_negative_feedbacks_bulk(batch)
+            except Exception as e:
+                print(f"⚠️ Lote de feedback falló ({len(batch)} registros), reintentando fila por fila: {e}")
+                for row in batch:
+                    try:
+                        database.save_negative_feedbacks_bulk([row])
+                    except Exception as row_error:
+                        print(f"❌ Error guardando feedback (chat_log_id={row[0]}): {row_error}")
+        finally:
+            with self._pending_cond:
+                self._pending -= len(batch)
+                self._pending_cond.notify_all()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            time.sleep(self._flush_seconds)
+            self._write(self._drain(batch))
+
+    def flush(self):
+        """Escribe de inmediato lo pendiente en la cola y espera el lote en curso del hilo."""
+        batch = self._drain([])
+        if batch:
+            self._write(batch)
+        with self._pending_cond:
+            if not self._pending_cond.wait_for(lambda: self._pending <= 0, timeout=self._exit_timeout):
+                print(f"⚠️ {self._pending} feedbacks sin escribir al cerrar")
+
+
+feedback_writer = FeedbackWriter()
+
 # ================================================================================================
 # RUTAS (ENDPOINTS)
 # ================================================================================================
@@ -277,94 +796,81 @@ def chat():
 
     start_time = time.time()
 
-    # 1. Actualizar estado de sesión
-    database.upsert_session_state(session_id)
-
-    # 2. Recuperar historial de conversación (últimas 5 interacciones)
-    history_tuples = database.get_recent_history(session_id, limit=5)
-    formatted_history = format_chat_history(history_tuples)
-
-    # 3. Retrieval (RAG) - Búsqueda semántica
-    try:
-        docs = vectorstore.similarity_search(user_query, k=RETRIEVAL_K)
-    except Exception as e:
-        print(f"❌ Error en vectorstore: {e}")
-        docs = []
-
-    # Construir contexto
-    context_text = "\n\n".join([
-        f"[{d.metadata.get('codigo_documento', 'DOC')}] {d.page_content}" 
-        for d in docs
-    ])
-    
-    # Extraer fuentes únicas
-    sources = list(set([
-        d.metadata.get('source', 'Desconocido') 
-        for d in docs
-    ]))
-
-    # 4. Generar respuesta con LLM
-    prompt_template = ChatPromptTemplate.from_messages([
-        ("system", SYSTEM_PROMPT),
-        ("human", "{question}")
-    ])
-
-    chain = prompt_template | llm
+    # 1-3. Sesión, historial y retrieval
+    turn = prepare_turn(user_query, session_id)
 
+    # 4. Generar respuesta con LLM (prefijo estático: caché implícito de Gemini)
+    usage = None
     try:
-        response_message = chain.invoke({
-            "context": context_text,
-            "chat_history": formatted_history,
-            "question": user_query
-        })
+        response_message = invoke_llm(turn["variables"])
         bot_response = response_message.content
+        usage = response_message.usage_metadata
     except Exception as e:
         print(f"❌ Error en LLM: {e}")
-        bot_response = "Lo siento, ha ocurrido un error al procesar tu solicitud. Por favor, intenta de nuevo."
+        bot_response = LLM_ERROR_MESSAGE
+
+    # 5-6. Tokens y logging
+    result = finalize_turn(turn, bot_response, usage, start_time)
+
+    return jsonify({"response": bot_response, **result})
 
-    latency = time.time() - start_time
 
-    # 5. Calcular tokens (estimación)
-    # Construir el prompt completo aproximado
-    full_prompt_text = f"""Eres un asistente virtual del laboratorio de control de calidad.
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Igual que /chat pero transmite la respuesta por Server-Sent Events a medida que
+    Gemini la genera (el primer texto llega en cuanto el modelo emite el primer token).
     
-CONTEXTO: {context_text}
-HISTORIAL: {formatted_history}
-PREGUNTA: {user_query}"""
+    Request Body: igual que /chat
     
-    tokens_in = calculate_tokens_gemini(full_prompt_text)
-    tokens_out = calculate_tokens_gemini(bot_response)
+    Eventos (text/event-stream):
+        data: {"delta": "fragmento de texto"}
+        ...
+        data: {"done": true, "sources": [...], "log_id": 123, "latency": 1.23, ...}
+    """
+    data = request.json
+    user_query = data.get('message', '')
+    session_id = data.get('session_id')
 
-    # 6. Logging en base de datos
-    context_docs_json = [
-        {
-            "source": d.metadata.get('source'),
-            "codigo": d.metadata.get('codigo_documento'),
-            "seccion": d.metadata.get('seccion')
-        }
-        for d in docs[:3]  # Solo primeros 3 para JSON
-    ]
+    if not user_query:
+        return jsonify({'error': 'Message is required'}), 400
 
-    log_id = database.log_interaction(
-        tokens_in=tokens_in,
-        tokens_out=tokens_out,
-        latency=latency,
-        user_query=user_query,
-        bot_response=bot_response,
-        session_id=session_id,
-        context_docs=context_docs_json
-    )
+    if not session_id:
+        session_id = str(uuid.uuid4())
 
-    return jsonify({
-        "response": bot_response,
-        "sources": sources,
-        "log_id": log_id,
-        "latency": round(latency, 2),
-        "session_id": session_id,
-        "tokens_in": tokens_in,
-        "tokens_out": tokens_out,
-        "cost_usd": round((tokens_in * 0.00001875 / 1000) + (tokens_out * 0.000075 / 1000), 6)
-    })
+    start_time = time.time()
+    turn = prepare_turn(user_query, session_id)
+
+    def generate():
+        # Acumular los chunks: la suma de AIMessageChunk concatena el texto y el uso de tokens
+        full_message = None
+        try:
+            for chunk in stream_llm(turn["variables"]):
+                full_message = chunk if full_message is None else full_message + chunk
+                if chunk.content:
+                    yield f"data: {app.json.dumps({'delta': chunk.content})}\n\n"
+        except Exception as e:
+            print(f"❌ Error en LLM (stream): {e}")
+            if full_message is None or not full_message.content:
+                full_message = None
+                yield f"data: {app.json.dumps({'delta': LLM_ERROR_MESSAGE})}\n\n"
+
+        if full_message is not None:
+            bot_response = full_message.content
+            usage = full_message.usage_metadata
+        else:
+            bot_response = LLM_ERROR_MESSAGE
+            usage = None
+
+        # Logging una sola vez, con la respuesta completa
+        result = finalize_turn(turn, bot_response, usage, start_time)
+        yield f"data: {app.json.dumps({'done': True, **result})}\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 
 @app.route('/vote', methods=['POST'])
@@ -403,7 +909,7 @@ def feedback():
         }
     """
     data = request.json
-    database.save_negative_feedback(
+    feedback_writer.put(
         chat_log_id=data.get('log_id'),
         comment=data.get('comment'),
         source=data.get('source', 'Web'),
@@ -432,17 +938,9 @@ def get_metrics():
     """
     stats = database.get_metrics()
     
-    # Obtener conteo de documentos en vectorstore
+    # Obtener conteo de documentos en vectorstore (cacheado)
     try:
-        conn = database.get_pg_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT COUNT(*) FROM langchain_pg_embedding WHERE collection_id = (SELECT uuid FROM langchain_pg_collection WHERE name = %s)",
-            (COLLECTION_NAME,)
-        )
-        doc_count = cursor.fetchone()[0] or 0
-        cursor.close()
-        conn.close()
+        doc_count = get_doc_count()
     except Exception as e:
         print(f"Error obteniendo conteo de documentos: {e}")
         doc_count = 0
@@ -474,15 +972,14 @@ def trigger_vectorization():
     """
     try:
         print("\n🔄 Disparando proceso de ingesta manual...")
-        ingest.ingest_pdfs()
+        # Sin eliminar el HNSW: esta misma tabla está atendiendo búsquedas
+        ingest.ingest_pdfs(drop_hnsw=False)
         
-        # Refrescar vectorstore
-        global vectorstore
-        vectorstore = PGVector(
-            connection=PG_CONNECTION_STRING,
-            collection_name=COLLECTION_NAME,
-            embeddings=embeddings
-        )
+        # ingest_pdfs incrementa la versión del corpus en PG (los demás workers la ven
+        # en CORPUS_VERSION_TTL segundos); este worker la relee ya mismo.
+        # No hace falta reconstruir el vectorstore: PGVector resuelve la colección
+        # por nombre en cada búsqueda, así que las filas nuevas ya son visibles.
+        get_corpus_version(refresh=True)
         
         return jsonify({"message": "Documentos re-ingestados correctamente."})
     except Exception as e:
@@ -514,6 +1011,7 @@ def clear_session():
 # ================================================================================================
 
 if __name__ == '__main__':
+    # Solo para desarrollo local. En producción: gunicorn -c gunicorn.conf.py wsgi:application
     port = int(os.environ.get("PORT", 8010))
     
     print("\n" + "=" * 80)
@@ -525,4 +1023,4 @@ if __name__ == '__main__':
     print(f"🤖 Modelo: {LLM_CONFIG['model']}")
     print("=" * 80 + "\n")
     
-    app.run(host='0.0.0.0', port=port, debug=False)
+    app.run(host='0.0.0.0', port=port, debug=False, threaded=True)
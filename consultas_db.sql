@@ -56,7 +56,7 @@ SELECT
     bot_response AS respuesta,
     tokens_in,
     tokens_out,
-    cost_usd AS costo,
+    cost_nanousd / 1e9 AS costo,
     latency AS latencia_seg,
     vote AS voto
 FROM chat_logs
@@ -68,7 +68,7 @@ SELECT
     COUNT(*) AS total_consultas,
     SUM(tokens_in) AS total_tokens_entrada,
     SUM(tokens_out) AS total_tokens_salida,
-    SUM(cost_usd) AS costo_total_usd,
+    SUM(cost_nanousd) / 1e9 AS costo_total_usd,
     AVG(latency) AS latencia_promedio_seg,
     COUNT(CASE WHEN vote = 'up' THEN 1 END) AS votos_positivos,
     COUNT(CASE WHEN vote = 'down' THEN 1 END) AS votos_negativos
@@ -211,7 +211,7 @@ SELECT
     (SELECT SUM(tokens_in) + SUM(tokens_out) FROM chat_logs) AS total_tokens,
     
     -- Costo
-    (SELECT ROUND(SUM(cost_usd)::NUMERIC, 4) FROM chat_logs) AS costo_total_usd,
+    (SELECT ROUND(SUM(cost_nanousd) / 1e9, 4) FROM chat_logs) AS costo_total_usd,
     
     -- Latencia promedio
     (SELECT ROUND(AVG(latency)::NUMERIC, 2) FROM chat_logs) AS latencia_promedio_seg,
@@ -21,26 +21,150 @@ Fecha: 27 de diciembre de 2025
 """
 
 from datetime import datetime
+import atexit
+from contextlib import contextmanager
+import threading
+import time
 import psycopg2
-from psycopg2.extras import Json
+from psycopg2 import pool
+from psycopg2.extensions import connection as PgConnection
+from psycopg2.extras import Json, execute_values
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Pool de conexiones (reutiliza sesiones ya autenticadas entre requests)
+PG_POOL_MIN = int(os.getenv("PG_POOL_MIN", "4"))
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", "16"))
+PG_STATEMENT_TIMEOUT_MS = int(os.getenv("PG_STATEMENT_TIMEOUT_MS", "5000"))
+
+# Historial conversacional guardado por sesión (chat_session_state.conversation_history)
+HISTORY_LIMIT = 5
+
+# Pricing Google Gemini 2.5 Flash en nano-dólares por token
+# ($0.00001875 / 1K tokens de entrada, $0.000075 / 1K tokens de salida)
+COST_IN_NANOUSD_PER_TOKEN = 18.75
+COST_OUT_NANOUSD_PER_TOKEN = 75.0
+
+# Rollup diario de métricas (vista materializada chat_logs_daily)
+METRICS_REFRESH_SECONDS = int(os.getenv("METRICS_REFRESH_SECONDS", "3600"))
+
+# Índice ANN (HNSW) sobre los embeddings
+EMBEDDING_DIMENSIONS = 768  # models/embedding-001
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 64
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "40"))  # Por sesión; >= RETRIEVAL_K
+
 # ================================================================================================
 # CONEXIÓN A POSTGRESQL
 # ================================================================================================
 
+def _pg_params() -> dict:
+    """Parámetros de conexión a PostgreSQL para LabIa."""
+    return {
+        "host": os.getenv("POSTGRES_HOST", "localhost"),
+        "port": os.getenv("POSTGRES_PORT", "5432"),
+        "database": os.getenv("POSTGRES_DB", "labia_db"),
+        "user": os.getenv("POSTGRES_USER", "postgres"),
+        "password": os.getenv("POSTGRES_PASSWORD", "")
+    }
+
+
 def get_pg_connection():
-    """Conexión a PostgreSQL con configuración para LabIa."""
-    return psycopg2.connect(
-        host=os.getenv("POSTGRES_HOST", "localhost"),
-        port=os.getenv("POSTGRES_PORT", "5432"),
-        database=os.getenv("POSTGRES_DB", "labia_db"),
-        user=os.getenv("POSTGRES_USER", "postgres"),
-        password=os.getenv("POSTGRES_PASSWORD", "")
-    )
+    """Conexión a PostgreSQL con configuración para LabIa (conexión dedicada, sin pool)."""
+    return psycopg2.connect(**_pg_params())
+
+
+_pg_pool = None
+_pg_pool_lock = threading.Lock()
+
+
+def get_pg_pool():
+    """
+    Devuelve el pool de conexiones del proceso, creándolo en el primer uso.
+    
+    La creación es perezosa para que, con servidores que hacen fork (gunicorn),
+    cada worker abra sus propios sockets en lugar de heredar los del proceso padre.
+    """
+    global _pg_pool
+    if _pg_pool is None:
+        with _pg_pool_lock:
+            if _pg_pool is None:
+                _pg_pool = pool.ThreadedConnectionPool(
+                    PG_POOL_MIN,
+                    PG_POOL_MAX,
+                    connection_factory=PreparedConnection,
+                    options=f"-c statement_timeout={PG_STATEMENT_TIMEOUT_MS}",
+                    **_pg_params()
+                )
+                atexit.register(_pg_pool.closeall)
+    return _pg_pool
+
+
+# ================================================================================================
+# SENTENCIAS PREPARADAS (una vez por conexión del pool)
+# ================================================================================================
+
+# nombre -> (tipos de parámetros, SQL con $1..$n). Se parsean y planifican una sola vez por
+# sesión de PostgreSQL; después cada turno solo envía EXECUTE con los valores.
+PREPARED_STATEMENTS = {
+    "record_turn_stmt": (
+        "text, text, timestamp, text, text, jsonb, integer, integer, real, bigint",
+        "SELECT record_chat_turn($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)"
+    ),
+    "history_stmt": (
+        "text",
+        "SELECT conversation_history FROM chat_session_state WHERE session_id = $1"
+    ),
+    "update_vote_stmt": (
+        "text, integer",
+        "UPDATE chat_logs SET vote = $1 WHERE id = $2"
+    ),
+}
+
+
+class PreparedConnection(PgConnection):
+    """Conexión del pool que recuerda qué sentencias ya preparó en su sesión."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def execute_prepared(cursor, name: str, params: tuple):
+    """
+    Ejecuta una sentencia de PREPARED_STATEMENTS, preparándola en el primer uso de la conexión.
+    
+    PREPARE no es transaccional: sobrevive a rollbacks y dura lo que la sesión, así que
+    basta con recordarlo por conexión. Si el PREPARE falla no se marca y se reintenta
+    en el siguiente uso.
+    """
+    conn = cursor.connection
+    if name not in conn.prepared:
+        types, sql = PREPARED_STATEMENTS[name]
+        cursor.execute(f"PREPARE {name} ({types}) AS {sql}")
+        conn.prepared.add(name)
+    cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+
+
+@contextmanager
+def pg_connection():
+    """
+    Toma prestada una conexión del pool y la devuelve al salir del bloque.
+    
+    Uso:
+        with pg_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(...)
+    
+    Al devolverla, el pool hace rollback de cualquier transacción sin commit.
+    """
+    pg_pool = get_pg_pool()
+    conn = pg_pool.getconn()
+    try:
+        yield conn
+    finally:
+        pg_pool.putconn(conn, close=bool(conn.closed))
 
 # ================================================================================================
 # INICIALIZACIÓN
@@ -92,11 +216,24 @@ def init_db():
                  tokens_in INTEGER DEFAULT 0,
                  tokens_out INTEGER DEFAULT 0,
                  latency REAL DEFAULT 0,
-                 cost_usd DECIMAL(10,6) DEFAULT 0,
+                 cost_nanousd BIGINT DEFAULT 0,
                  vote TEXT DEFAULT NULL
                  )''')
     print("✅ Tabla chat_logs creada")
 
+    # Migración: cost_usd DECIMAL(10,6) → cost_nanousd BIGINT (agregados enteros, sin NUMERIC).
+    # La vista chat_logs_daily depende de la columna: se elimina y se recrea más abajo.
+    c.execute(
+        """SELECT 1 FROM information_schema.columns
+           WHERE table_name = 'chat_logs' AND column_name = 'cost_usd'"""
+    )
+    if c.fetchone():
+        c.execute('''DROP MATERIALIZED VIEW IF EXISTS chat_logs_daily;
+                     ALTER TABLE chat_logs ADD COLUMN IF NOT EXISTS cost_nanousd BIGINT DEFAULT 0;
+                     UPDATE chat_logs SET cost_nanousd = ROUND(cost_usd * 1000000000)::bigint;
+                     ALTER TABLE chat_logs DROP COLUMN cost_usd;''')
+        print("✅ chat_logs.cost_usd migrado a cost_nanousd (BIGINT)")
+
     # Estado por sesión con historial conversacional en JSONB
     c.execute('''CREATE TABLE IF NOT EXISTS chat_session_state (
                  session_id TEXT PRIMARY KEY,
@@ -107,14 +244,76 @@ def init_db():
                  )''')
     print("✅ Tabla chat_session_state creada (con conversation_history JSONB)")
 
+    # Turno completo del chat en una sola llamada: log + estado/historial de la sesión
+    c.execute(f'''CREATE OR REPLACE FUNCTION record_chat_turn(
+                     p_user_id text, p_session_id text, p_ts timestamp,
+                     p_query text, p_response text, p_context jsonb,
+                     p_tokens_in integer, p_tokens_out integer,
+                     p_latency real, p_cost_nanousd bigint)
+                 RETURNS integer LANGUAGE plpgsql AS $$
+                 DECLARE
+                     new_id integer;
+                 BEGIN
+                     -- Sin p_ts se usa el reloj de PG: el mismo que corta el rollup diario
+                     p_ts := COALESCE(p_ts, LOCALTIMESTAMP);
+                     INSERT INTO chat_logs
+                         (user_id, session_id, timestamp, user_query, bot_response, context_docs,
+                          tokens_in, tokens_out, latency, cost_nanousd, vote)
+                     VALUES (p_user_id, p_session_id, p_ts, p_query, p_response, p_context,
+                             p_tokens_in, p_tokens_out, p_latency, p_cost_nanousd, NULL)
+                     RETURNING id INTO new_id;
+
+                     IF p_session_id IS NOT NULL THEN
+                         -- Solo los turnos completos entran al historial (últimos {HISTORY_LIMIT})
+                         INSERT INTO chat_session_state
+                             (session_id, user_id, conversation_history, last_interaction, created_at)
+                         VALUES (p_session_id, p_user_id,
+                                 CASE WHEN p_query IS NOT NULL AND p_response IS NOT NULL
+                                      THEN jsonb_build_array(jsonb_build_object(
+                                          'user_query', p_query, 'bot_response', p_response))
+                                      ELSE '[]'::jsonb END,
+                                 p_ts, p_ts)
+                         ON CONFLICT(session_id) DO UPDATE SET
+                           user_id = COALESCE(EXCLUDED.user_id, chat_session_state.user_id),
+                           last_interaction = EXCLUDED.last_interaction,
+                           conversation_history = jsonb_path_query_array(
+                             chat_session_state.conversation_history || EXCLUDED.conversation_history,
+                             '$[last - {HISTORY_LIMIT - 1} to last]');
+                     END IF;
+
+                     RETURN new_id;
+                 END;
+                 $$''')
+    print("✅ Función record_chat_turn creada")
+
     # Índices útiles
     try:
         c.execute("CREATE INDEX IF NOT EXISTS idx_chat_logs_session_time ON chat_logs(session_id, timestamp)")
         c.execute("CREATE INDEX IF NOT EXISTS idx_session_state_last_interaction ON chat_session_state(last_interaction)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_chat_logs_vote ON chat_logs(vote) WHERE vote IS NOT NULL")
+        # BRIN: chat_logs se inserta en orden de timestamp → índice diminuto para rangos de fechas
+        c.execute("CREATE INDEX IF NOT EXISTS idx_chat_logs_ts_brin ON chat_logs USING brin(timestamp)")
         print("✅ Índices creados")
     except Exception as e:
         print(f"⚠️  Índices ya existen: {e}")
     
+    # Rollup diario para /metrics (solo días completos; el día en curso se suma desde chat_logs)
+    c.execute('''CREATE MATERIALIZED VIEW IF NOT EXISTS chat_logs_daily AS
+                 SELECT date_trunc('day', timestamp) AS day,
+                        COUNT(*) AS chats,
+                        SUM(latency) AS latency_sum,
+                        SUM(tokens_in) AS tokens_in,
+                        SUM(tokens_out) AS tokens_out,
+                        SUM(cost_nanousd) AS cost_nanousd,
+                        COUNT(*) FILTER (WHERE vote = 'up') AS pos_votes,
+                        COUNT(*) FILTER (WHERE vote = 'down') AS neg_votes
+                 FROM chat_logs
+                 WHERE timestamp < date_trunc('day', NOW())
+                 GROUP BY 1''')
+    # Índice único: requerido por REFRESH ... CONCURRENTLY
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_chat_logs_daily_day ON chat_logs_daily(day)")
+    print("✅ Vista materializada chat_logs_daily creada")
+    
     # Tabla de feedbacks negativos
     c.execute('''CREATE TABLE IF NOT EXISTS negative_feedbacks (
                  id SERIAL PRIMARY KEY,
@@ -127,19 +326,140 @@ def init_db():
                  )''')
     print("✅ Tabla negative_feedbacks creada")
     
+    # Versión del corpus por colección: la incrementa cada ingesta y la leen todos los
+    # workers de app.py para invalidar sus cachés de retrieval
+    c.execute('''CREATE TABLE IF NOT EXISTS corpus_state (
+                 collection_name TEXT PRIMARY KEY,
+                 version BIGINT NOT NULL DEFAULT 0,
+                 updated_at TIMESTAMP DEFAULT NOW()
+                 )''')
+    print("✅ Tabla corpus_state creada")
+    
     conn.commit()
     conn.close()
     print("=" * 80)
     print("✅ BASE DE DATOS INICIALIZADA CORRECTAMENTE\n")
 
+def ensure_embedding_indexes():
+    """
+    Crea los índices auxiliares sobre la tabla de embeddings de LangChain.
+    
+    La tabla langchain_pg_embedding la crea PGVector, por eso esta migración se ejecuta
+    después de inicializar el vectorstore y no dentro de init_db().
+    
+    Índices:
+    - ix_emb_collection: filtro por collection_id (conteo de documentos y búsquedas)
+    - ix_emb_hnsw: HNSW con distancia coseno para similarity_search (sub-lineal vs. scan)
+    
+    HNSW requiere que la columna tenga dimensión fija, por eso se tipa como
+    vector(EMBEDDING_DIMENSIONS) si PGVector la creó sin dimensión.
+    
+    Nota: tras una re-ingesta masiva conviene reconstruir el índice sin bloquear lecturas:
+        REINDEX INDEX CONCURRENTLY ix_emb_hnsw;
+    
+    Los errores se propagan: si el HNSW no se puede reconstruir tras una carga, las
+    búsquedas quedarían en scan secuencial sin que nadie se entere.
+    """
+    # Conexión dedicada (sin statement_timeout del pool): crear índices puede tardar
+    conn = get_pg_connection()
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute("CREATE INDEX IF NOT EXISTS ix_emb_collection ON langchain_pg_embedding(collection_id)")
+            
+            # Tipar la columna embedding (atttypmod = -1 → vector sin dimensión)
+            cursor.execute(
+                """SELECT atttypmod FROM pg_attribute
+                   WHERE attrelid = 'langchain_pg_embedding'::regclass AND attname = 'embedding'"""
+            )
+            if cursor.fetchone()[0] == -1:
+                cursor.execute(
+                    f"ALTER TABLE langchain_pg_embedding ALTER COLUMN embedding TYPE vector({EMBEDDING_DIMENSIONS})"
+                )
+            
+            cursor.execute(
+                f"""CREATE INDEX IF NOT EXISTS ix_emb_hnsw ON langchain_pg_embedding
+                    USING hnsw (embedding vector_cosine_ops)
+                    WITH (m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION})"""
+            )
+    finally:
+        conn.close()
+    print("✅ Índices de embeddings verificados")
+
+def drop_embedding_hnsw_index():
+    """
+    Elimina el índice HNSW de embeddings antes de una carga masiva.
+    
+    Insertar con el índice presente obliga a actualizar el grafo fila por fila; cargar
+    sin índice y reconstruirlo al final (ensure_embedding_indexes) es mucho más rápido
+    y deja un grafo mejor empaquetado. Mientras tanto las búsquedas hacen scan secuencial.
+    
+    Solo para ingestas desde la CLI: con la app sirviendo consultas sobre la misma tabla,
+    el índice se mantiene (ver ingest_pdfs(drop_hnsw=False) en /vectorize).
+    """
+    conn = None
+    try:
+        conn = get_pg_connection()
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute("DROP INDEX IF EXISTS ix_emb_hnsw")
+        print("✅ Índice HNSW de embeddings eliminado (se reconstruye al terminar la carga)")
+    except Exception as e:
+        print(f"⚠️  No se pudo eliminar el índice HNSW: {e}")
+    finally:
+        if conn is not None:
+            conn.close()
+
+# ================================================================================================
+# VERSIÓN DEL CORPUS
+# ================================================================================================
+
+def bump_corpus_version(collection_name: str) -> int:
+    """
+    Incrementa la versión del corpus de una colección (tras cada ingesta o reset).
+    
+    Returns:
+        Nueva versión
+    """
+    with pg_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """INSERT INTO corpus_state (collection_name, version, updated_at)
+               VALUES (%s, 1, NOW())
+               ON CONFLICT (collection_name)
+               DO UPDATE SET version = corpus_state.version + 1, updated_at = NOW()
+               RETURNING version""",
+            (collection_name,)
+        )
+        version = cursor.fetchone()[0]
+        conn.commit()
+    return version
+
+def get_corpus_version(collection_name: str) -> int:
+    """Versión actual del corpus de una colección (0 si nunca se ingestó)."""
+    with pg_connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT version FROM corpus_state WHERE collection_name = %s", (collection_name,))
+        row = cursor.fetchone()
+    return row[0] if row else 0
+
 # ================================================================================================
 # LOGGING DE INTERACCIONES
 # ================================================================================================
 
-def log_interaction(tokens_in=0, tokens_out=0, latency=0.0, user_query=None, bot_response=None, 
-                   session_id=None, user_id=None, context_docs=None):
+def cost_nanousd(tokens_in: int, tokens_out: int) -> int:
+    """Costo de una interacción en nano-dólares (entero) con pricing Google Gemini 2.5 Flash."""
+    return round(tokens_in * COST_IN_NANOUSD_PER_TOKEN + tokens_out * COST_OUT_NANOUSD_PER_TOKEN)
+
+
+def record_turn(tokens_in=0, tokens_out=0, latency=0.0, user_query=None, bot_response=None, 
+                session_id=None, user_id=None, context_docs=None):
     """
-    Registra una interacción completa del chat con cálculo de costos Google Gemini.
+    Registra un turno completo del chat con cálculo de costos Google Gemini.
+    
+    En una sola llamada a la función record_chat_turn (creada en init_db) y un solo commit:
+    - INSERT en chat_logs (devuelve el log_id)
+    - Upsert de chat_session_state: last_interaction, user_id y conversation_history
+      (agrega el turno y conserva solo los últimos HISTORY_LIMIT)
+    Así el log y el estado de la sesión nunca quedan desfasados.
     
     Pricing Google Gemini 2.5 Flash:
     - Input: $0.00001875 / 1K tokens
@@ -158,12 +478,8 @@ def log_interaction(tokens_in=0, tokens_out=0, latency=0.0, user_query=None, bot
     Returns:
         log_id: ID del registro creado
     """
-    conn = get_pg_connection()
-    cursor = conn.cursor()
-    timestamp = datetime.now()
-    
-    # Calcular costo (Google Gemini 2.5 Flash pricing)
-    cost_usd = (tokens_in * 0.00001875 / 1000) + (tokens_out * 0.000075 / 1000)
+    # Calcular costo (Google Gemini 2.5 Flash pricing), en nano-dólares
+    cost = cost_nanousd(tokens_in, tokens_out)
     
     # Convertir context_docs a JSON si es un dict/list
     if isinstance(context_docs, (dict, list)):
@@ -171,29 +487,79 @@ def log_interaction(tokens_in=0, tokens_out=0, latency=0.0, user_query=None, bot
     else:
         context_docs_json = context_docs
     
-    cursor.execute(
-        """INSERT INTO chat_logs
-                 (user_id, session_id, timestamp, user_query, bot_response, context_docs,
-                  tokens_in, tokens_out, latency, cost_usd, vote)
-                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id""",
-        (user_id, session_id, timestamp, user_query, bot_response, context_docs_json,
-         tokens_in, tokens_out, latency, cost_usd, None),
-    )
-    log_id = cursor.fetchone()[0]
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with pg_connection() as conn, conn.cursor() as cursor:
+        execute_prepared(cursor, "record_turn_stmt", (
+            user_id, session_id, None, user_query, bot_response, context_docs_json,
+            tokens_in, tokens_out, latency, cost
+        ))
+        log_id = cursor.fetchone()[0]
+        conn.commit()
     return log_id
 
+def log_interactions_bulk(interactions, page_size: int = 100):
+    """
+    Inserta muchas interacciones en chat_logs con execute_values (backfill / replay).
+    
+    A diferencia de record_turn, no actualiza chat_session_state: pensado para scripts
+    de carga, no para el flujo online del chat.
+    
+    Args:
+        interactions: Lista de dicts con las mismas claves que los argumentos de
+            record_turn (tokens_in, tokens_out, latency, user_query, bot_response,
+            session_id, user_id, context_docs); 'timestamp' es opcional (sin él se usa
+            el reloj de PG, igual que record_turn)
+        page_size: Filas por sentencia INSERT
+    
+    Returns:
+        Lista de log_id en el mismo orden que interactions
+    """
+    if not interactions:
+        return []
+
+    rows = []
+    for it in interactions:
+        tokens_in = it.get('tokens_in', 0)
+        tokens_out = it.get('tokens_out', 0)
+        context_docs = it.get('context_docs')
+        rows.append((
+            it.get('user_id'),
+            it.get('session_id'),
+            it.get('timestamp'),
+            it.get('user_query'),
+            it.get('bot_response'),
+            Json(context_docs) if isinstance(context_docs, (dict, list)) else context_docs,
+            tokens_in,
+            tokens_out,
+            it.get('latency', 0.0),
+            cost_nanousd(tokens_in, tokens_out)
+        ))
+
+    with pg_connection() as conn, conn.cursor() as cursor:
+        result = execute_values(
+            cursor,
+            """INSERT INTO chat_logs
+                     (user_id, session_id, timestamp, user_query, bot_response, context_docs,
+                      tokens_in, tokens_out, latency, cost_nanousd)
+                     VALUES %s RETURNING id""",
+            rows,
+            template="(%s, %s, COALESCE(%s, LOCALTIMESTAMP), %s, %s, %s, %s, %s, %s, %s)",
+            page_size=page_size,
+            fetch=True
+        )
+        conn.commit()
+    return [r[0] for r in result]
+
 # ================================================================================================
 # HISTORIAL CONVERSACIONAL
 # ================================================================================================
 
-def get_recent_history(session_id: str, limit: int = 5):
+def get_recent_history(session_id: str, limit: int = HISTORY_LIMIT):
     """
     Devuelve las últimas N interacciones (user_query, bot_response) para una sesión.
     
     IMPORTANTE: Para LabIa mantenemos historial de las últimas 5 interacciones.
+    Se leen de chat_session_state.conversation_history (una fila por clave primaria,
+    mantenida por record_turn) en lugar de ordenar chat_logs en cada turno.
     
     Args:
         session_id: ID de la sesión
@@ -205,23 +571,13 @@ def get_recent_history(session_id: str, limit: int = 5):
     if not session_id:
         return []
 
-    conn = get_pg_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """SELECT user_query, bot_response
-           FROM chat_logs
-           WHERE session_id = %s
-             AND user_query IS NOT NULL
-             AND bot_response IS NOT NULL
-           ORDER BY id DESC
-           LIMIT %s""",
-        (session_id, limit)
-    )
-    rows = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    rows.reverse()  # Orden cronológico (más antiguo → más reciente)
-    return [(u, b) for (u, b) in rows]
+    with pg_connection() as conn, conn.cursor() as cursor:
+        execute_prepared(cursor, "history_stmt", (session_id,))
+        row = cursor.fetchone()
+    if not row or not row[0]:
+        return []
+    # Ya en orden cronológico (más antiguo → más reciente)
+    return [(t['user_query'], t['bot_response']) for t in row[0][-limit:]]
 
 # ================================================================================================
 # GESTIÓN DE SESIONES
@@ -237,20 +593,17 @@ def upsert_session_state(session_id: str, user_id: str = None):
     """
     if not session_id:
         return
-    conn = get_pg_connection()
-    cursor = conn.cursor()
     now = datetime.now()
-    cursor.execute(
-        """INSERT INTO chat_session_state (session_id, user_id, last_interaction, created_at)
-           VALUES (%s, %s, %s, %s)
-           ON CONFLICT(session_id) DO UPDATE SET
-             user_id = COALESCE(EXCLUDED.user_id, chat_session_state.user_id),
-             last_interaction = EXCLUDED.last_interaction""",
-        (session_id, user_id, now, now)
-    )
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with pg_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """INSERT INTO chat_session_state (session_id, user_id, last_interaction, created_at)
+               VALUES (%s, %s, %s, %s)
+               ON CONFLICT(session_id) DO UPDATE SET
+                 user_id = COALESCE(EXCLUDED.user_id, chat_session_state.user_id),
+                 last_interaction = EXCLUDED.last_interaction""",
+            (session_id, user_id, now, now)
+        )
+        conn.commit()
 
 
 def clear_session(session_id: str):
@@ -263,13 +616,10 @@ def clear_session(session_id: str):
     """
     if not session_id:
         return
-    conn = get_pg_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM chat_logs WHERE session_id = %s", (session_id,))
-    cursor.execute("DELETE FROM chat_session_state WHERE session_id = %s", (session_id,))
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with pg_connection() as conn, conn.cursor() as cursor:
+        cursor.execute("DELETE FROM chat_logs WHERE session_id = %s", (session_id,))
+        cursor.execute("DELETE FROM chat_session_state WHERE session_id = %s", (session_id,))
+        conn.commit()
     print(f"✅ Sesión {session_id} limpiada")
 
 # ================================================================================================
@@ -284,12 +634,9 @@ def update_vote(log_id, vote_type):
         log_id: ID del registro de chat
         vote_type: 'up' o 'down'
     """
-    conn = get_pg_connection()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE chat_logs SET vote = %s WHERE id = %s", (vote_type, log_id))
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with pg_connection() as conn, conn.cursor() as cursor:
+        execute_prepared(cursor, "update_vote_stmt", (vote_type, log_id))
+        conn.commit()
 
 
 def save_negative_feedback(chat_log_id, comment, source='Desconocido', response=''):
@@ -302,62 +649,138 @@ def save_negative_feedback(chat_log_id, comment, source='Desconocido', response=
         source: Fuente del feedback
         response: Respuesta que generó el feedback
     """
-    conn = get_pg_connection()
-    cursor = conn.cursor()
     timestamp = datetime.now()
-    cursor.execute(
-        """INSERT INTO negative_feedbacks (chat_log_id, timestamp, comment, source, response)
-           VALUES (%s, %s, %s, %s, %s)""",
-        (chat_log_id, timestamp, comment, source, response)
-    )
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with pg_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """INSERT INTO negative_feedbacks (chat_log_id, timestamp, comment, source, response)
+               VALUES (%s, %s, %s, %s, %s)""",
+            (chat_log_id, timestamp, comment, source, response)
+        )
+        conn.commit()
+
+
+def save_negative_feedbacks_bulk(rows, page_size: int = 100):
+    """
+    Guarda varios feedbacks negativos con execute_values (N filas por sentencia).
+    
+    Args:
+        rows: Lista de tuplas (chat_log_id, timestamp, comment, source, response)
+        page_size: Filas por sentencia INSERT
+    """
+    if not rows:
+        return
+    with pg_connection() as conn, conn.cursor() as cursor:
+        execute_values(
+            cursor,
+            """INSERT INTO negative_feedbacks (chat_log_id, timestamp, comment, source, response)
+               VALUES %s""",
+            rows,
+            page_size=page_size
+        )
+        conn.commit()
 
 # ================================================================================================
 # MÉTRICAS
 # ================================================================================================
 
+_metrics_refreshed_at = float('-inf')  # time.monotonic() del último refresh
+_metrics_refresh_lock = threading.Lock()
+
+
+def refresh_daily_metrics():
+    """
+    Recalcula chat_logs_daily sin bloquear lecturas (REFRESH ... CONCURRENTLY).
+    
+    Usa una conexión dedicada: el refresh recorre chat_logs y puede superar el
+    statement_timeout del pool.
+    """
+    conn = get_pg_connection()
+    conn.autocommit = True
+    cursor = conn.cursor()
+    cursor.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY chat_logs_daily")
+    cursor.close()
+    conn.close()
+
+
+def _maybe_refresh_daily_metrics():
+    """Dispara el refresh en segundo plano si pasaron METRICS_REFRESH_SECONDS desde el último."""
+    global _metrics_refreshed_at
+    if time.monotonic() - _metrics_refreshed_at < METRICS_REFRESH_SECONDS:
+        return
+    if not _metrics_refresh_lock.acquire(blocking=False):
+        return  # Ya hay un refresh en curso
+    _metrics_refreshed_at = time.monotonic()
+
+    def run():
+        try:
+            refresh_daily_metrics()
+        except Exception as e:
+            print(f"⚠️  No se pudo refrescar chat_logs_daily: {e}")
+        finally:
+            _metrics_refresh_lock.release()
+
+    threading.Thread(target=run, daemon=True, name="metrics-refresh").start()
+
+
 def get_metrics():
     """
     Obtiene métricas generales del chatbot LabIa.
     
     Incluye cálculo de costos con pricing de Google Gemini 2.5 Flash.
     
+    Suma los días completos desde chat_logs_daily (O(días)) y solo escanea chat_logs
+    para las filas posteriores al último día del rollup (índice BRIN por timestamp).
+    El rollup se refresca en segundo plano cada METRICS_REFRESH_SECONDS; votos o
+    sesiones borradas en días ya consolidados se reflejan en el siguiente refresh.
+    
     Returns:
         Dict con métricas: chats, latency, tokens, costos, satisfacción
     """
-    conn = get_pg_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT COUNT(*), AVG(latency), SUM(tokens_in), SUM(tokens_out), SUM(cost_usd) FROM chat_logs")
-    total_chats, avg_latency, total_in, total_out, total_cost = cursor.fetchone()
-    
-    cursor.execute("SELECT COUNT(*) FROM chat_logs WHERE vote = 'up'")
-    pos_votes = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM chat_logs WHERE vote = 'down'")
-    neg_votes = cursor.fetchone()[0]
+    _maybe_refresh_daily_metrics()
+
+    with pg_connection() as conn, conn.cursor() as cursor:
+        # Un solo round-trip: rollup diario + filas recientes (votos con FILTER)
+        cursor.execute(
+            """WITH boundary AS (
+                   SELECT COALESCE(MAX(day) + INTERVAL '1 day', '-infinity'::timestamp) AS ts
+                   FROM chat_logs_daily
+               ), totals AS (
+                   SELECT chats, latency_sum, tokens_in, tokens_out, cost_nanousd, pos_votes, neg_votes
+                   FROM chat_logs_daily
+                   UNION ALL
+                   SELECT COUNT(*), SUM(latency), SUM(tokens_in), SUM(tokens_out), SUM(cost_nanousd),
+                          COUNT(*) FILTER (WHERE vote = 'up'),
+                          COUNT(*) FILTER (WHERE vote = 'down')
+                   FROM chat_logs
+                   WHERE timestamp >= (SELECT ts FROM boundary)
+               )
+               SELECT SUM(chats), SUM(latency_sum)::float8 / NULLIF(SUM(chats), 0),
+                      SUM(tokens_in), SUM(tokens_out), SUM(cost_nanousd),
+                      SUM(pos_votes), SUM(neg_votes)
+               FROM totals"""
+        )
+        (total_chats, avg_latency, total_in, total_out, total_cost,
+         pos_votes, neg_votes) = cursor.fetchone()
     
+    total_chats = int(total_chats or 0)
+    pos_votes = int(pos_votes or 0)
+    neg_votes = int(neg_votes or 0)
     total_votes = pos_votes + neg_votes
     satisfaction = (pos_votes / total_votes * 100) if total_votes > 0 else 0
     
     total_in = int(total_in or 0)
     total_out = int(total_out or 0)
-    total_cost = float(total_cost or 0)
-    
-    cursor.close()
-    conn.close()
+    total_cost = int(total_cost or 0) / 1e9  # nano-dólares → USD
     
     return {
-        "total_chats": total_chats or 0,
+        "total_chats": total_chats,
         "avg_latency": round(float(avg_latency) if avg_latency else 0, 2),
         "tokens_in": total_in,
         "tokens_out": total_out,
         "total_tokens": total_in + total_out,
         "cost_usd": round(total_cost, 4),
-        "pos_votes": pos_votes or 0,
-        "neg_votes": neg_votes or 0,
+        "pos_votes": pos_votes,
+        "neg_votes": neg_votes,
         "satisfaction": round(satisfaction, 1)
     }
 
@@ -3,22 +3,41 @@ Configuración gRPC para resolver problemas de DNS en Docker
 Este archivo fuerza a gRPC a usar el resolver nativo en lugar de c-ares
 """
 import os
+import threading
 import grpc
+from cachetools import TTLCache
+from dotenv import load_dotenv
+
+# Se importa antes que el load_dotenv() de app.py/ingest.py: el .env se carga aquí para
+# que DNS_CACHE_TTL (y cualquier otra variable leída al importar) tome su valor
+load_dotenv()
 
 # Forzar IPv4 y deshabilitar IPv6 (causa problemas DNS en Docker)
 os.environ['GRPC_DNS_RESOLVER'] = 'native'
 os.environ['GRPC_VERBOSITY'] = 'ERROR'  # Reducir verbosidad en producción
 os.environ['GRPC_ENABLE_FORK_SUPPORT'] = '1'
 
+# Caché de resoluciones DNS (segundos); los endpoints de Gemini se consultan en cada llamada
+DNS_CACHE_TTL = int(os.getenv("DNS_CACHE_TTL", "60"))
+
 # Deshabilitar IPv6 para evitar timeouts
 try:
     import socket
     old_getaddrinfo = socket.getaddrinfo
+    _dns_cache = TTLCache(maxsize=1024, ttl=DNS_CACHE_TTL)
+    _dns_cache_lock = threading.Lock()
     
     def new_getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
-        """Wrapper que fuerza IPv4 (AF_INET) en lugar de IPv6"""
-        # Forzar AF_INET (IPv4) en lugar de AF_UNSPEC (cualquiera)
-        return old_getaddrinfo(host, port, socket.AF_INET, type, proto, flags)
+        """Wrapper que fuerza IPv4 (AF_INET) en lugar de IPv6 y cachea el resultado"""
+        key = (host, port, type, proto, flags)
+        with _dns_cache_lock:
+            result = _dns_cache.get(key)
+        if result is None:
+            # Forzar AF_INET (IPv4) en lugar de AF_UNSPEC (cualquiera)
+            result = old_getaddrinfo(host, port, socket.AF_INET, type, proto, flags)
+            with _dns_cache_lock:
+                _dns_cache[key] = result
+        return result
     
     socket.getaddrinfo = new_getaddrinfo
     print("✅ gRPC configurado para usar IPv4 únicamente")
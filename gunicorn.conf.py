@@ -0,0 +1,31 @@
+"""
+================================================================================================
+GUNICORN.CONF.PY - RAG LABIA
+Configuración de gunicorn para producción
+================================================================================================
+
+Equivale a:
+    gunicorn -k gthread --workers 2 --threads 16 --timeout 120 --keep-alive 75 --preload wsgi:application
+
+Con preload, los clientes de Gemini, el LLM y el vectorstore se crean una sola vez en el
+proceso maestro y los workers los heredan (copy-on-write). El pool de psycopg2 se crea
+de forma perezosa en cada worker; las conexiones SQLAlchemy abiertas por el maestro se
+descartan tras el fork para no compartir sockets.
+================================================================================================
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8010')}"
+worker_class = "gthread"
+workers = int(os.environ.get("GUNICORN_WORKERS", "2"))
+threads = int(os.environ.get("GUNICORN_THREADS", "16"))
+timeout = 120
+keepalive = 75
+preload_app = True
+
+
+def post_fork(server, worker):
+    """Descarta las conexiones del engine heredadas del maestro (cada worker abre las suyas)."""
+    from app import vector_engine
+    vector_engine.dispose(close=False)
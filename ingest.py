@@ -23,35 +23,74 @@ import grpc_config
 
 import os
 import re
+import json
 import glob
 import logging
+import hashlib
+import importlib.util
+import pickle
+import tempfile
+import uuid
+import functools
 import ssl
+import asyncio
+import atexit
+import threading
 import httpx
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from itertools import repeat
 from datetime import datetime
 from typing import List, Dict, Tuple, Optional
 from dotenv import load_dotenv
 
 # PDF Processing Libraries
-import pdfplumber
+# pdfplumber y las librerías de OCR se importan al primer uso dentro de las funciones que
+# las necesitan: los workers del pool (spawn) re-importan este módulo y la mayoría de los
+# PDFs solo pasa por PyMuPDF. Aquí solo se verifica que estén instaladas.
 import fitz  # PyMuPDF
+OCR_AVAILABLE = all(importlib.util.find_spec(m) for m in ("pytesseract", "PIL", "pdf2image"))
+if not OCR_AVAILABLE:
+    print("⚠️ OCR no disponible (pytesseract/Pillow/pdf2image). Solo se usarán extractores nativos.")
+
+# OCR en proceso (tesserocr): API de Tesseract residente, sin lanzar el binario por página
+TESSEROCR_AVAILABLE = importlib.util.find_spec("tesserocr") is not None
+
+# Motor regex DFA opcional (google-re2): tiempo lineal, sin backtracking
 try:
-    import pytesseract
-    from PIL import Image
-    from pdf2image import convert_from_path
-    OCR_AVAILABLE = True
+    import re2
+    RE2_AVAILABLE = True
 except ImportError:
-    OCR_AVAILABLE = False
-    print("⚠️ OCR no disponible (pytesseract/Pillow/pdf2image). Solo se usarán extractores nativos.")
+    RE2_AVAILABLE = False
+
+# Carga masiva: COPY binario con psycopg 3 (dependencia de langchain-postgres)
+try:
+    import numpy as np
+    import psycopg
+    from psycopg.types.json import Jsonb
+    from pgvector.psycopg import register_vector
+    COPY_AVAILABLE = True
+except ImportError:
+    COPY_AVAILABLE = False
+
+# Barra de progreso opcional para la ingesta por consola
+try:
+    from tqdm import tqdm
+    TQDM_AVAILABLE = True
+except ImportError:
+    TQDM_AVAILABLE = False
 
 # Data Processing
-import pandas as pd
 import pint
 
+# INSERT por páginas (respaldo del COPY)
+from psycopg2.extras import Json, execute_values
+
 # LangChain
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_postgres import PGVector
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 
 # Database
 import database
@@ -83,12 +122,65 @@ COLLECTION_NAME = "labia_embeddings"
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1024"))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "150"))
 
+# Splitter compartido por todos los PDFs (se construye una sola vez al importar)
+TEXT_SPLITTER = RecursiveCharacterTextSplitter(
+    chunk_size=CHUNK_SIZE,
+    chunk_overlap=CHUNK_OVERLAP,
+    length_function=len,
+    separators=["\n\n", "\n", ". ", " ", ""],
+    keep_separator=True
+)
+# Secciones de 2-3 líneas se unen a la sección siguiente antes del splitter, y las colas
+# chicas que deja el splitter se unen al chunk anterior (sin repetir el overlap) mientras
+# el resultado no supere CHUNK_SIZE
+CHUNK_MERGE_MIN_CHARS = int(os.getenv("CHUNK_MERGE_MIN_CHARS", "100"))
+CHUNK_MERGE_MIN_OVERLAP = 10  # Coincidencias más cortas entre chunks no se tratan como overlap
+
+# Extracción paralela por páginas (procesos: pdfplumber y OCR son CPU-bound)
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))
+PARALLEL_MIN_PAGES = 4  # PDFs más cortos se procesan en serie (no compensa repartir)
+
+# Flags de PyMuPDF para texto: une palabras cortadas con guión al final de línea y
+# expande ligaduras (ﬁ → fi) para que el texto coincida con las preguntas
+PYMUPDF_TEXT_FLAGS = fitz.TEXT_PRESERVE_WHITESPACE | fitz.TEXT_MEDIABOX_CLIP | fitz.TEXT_DEHYPHENATE
+
+# Caché en disco de la extracción (re-ingestas sin re-extraer PDFs que no cambiaron)
+EXTRACTION_CACHE_DIR = os.getenv("EXTRACTION_CACHE_DIR", "./.cache/extraction")
+EXTRACTION_CACHE_VERSION = 3  # Incrementar si cambia la lógica de extracción (3: OCR_DPI/OCR_MAX_SIDE, tesserocr)
+# Caché de OCR por contenido de la página rasterizada (mismo escaneo/logo → mismo texto)
+OCR_CACHE_DIR = os.path.join(EXTRACTION_CACHE_DIR, "ocr")
+OCR_LANG = "spa"
+# Rasterizado para OCR: 200 dpi es la meseta de precisión de Tesseract; páginas de formato
+# grande (planos, A3) se reducen a OCR_MAX_SIDE px de lado (el costo crece con los píxeles)
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "2500"))
+
+# Sondeo de capa de texto: palabras por página (en las primeras páginas) para ir directo a PyMuPDF
+PROBE_PAGES = 2
+PROBE_MIN_WORDS_PER_PAGE = 50
+
+# Embeddings por lotes (batchEmbedContents admite hasta 100 textos por request)
+EMBED_BATCH_SIZE = 100
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "8"))  # Requests simultáneos (cuota RPM)
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "5"))  # Reintentos por lote ante 429/5xx
+EMBED_RETRY_BASE_DELAY = 1.0  # Segundos; se duplica en cada reintento
+INGEST_FLUSH_SIZE = int(os.getenv("INGEST_FLUSH_SIZE", "500"))  # Chunks acumulados (de varios PDFs) por carga
+# Filtro previo a la API de embeddings: chunks de texto demasiado cortos o casi sin
+# letras (separadores, números de página sueltos, basura de OCR) no se envían
+MIN_CHUNK_CHARS = int(os.getenv("MIN_CHUNK_CHARS", "80"))
+MIN_CHUNK_ALPHA_RATIO = float(os.getenv("MIN_CHUNK_ALPHA_RATIO", "0.3"))
+INSERT_PAGE_SIZE = 500  # Filas por INSERT multi-VALUES cuando no hay COPY
+# Con --reset o al menos estos PDFs, el HNSW se elimina y se reconstruye tras la carga;
+# en ingestas chicas sobre una colección grande conviene mantenerlo
+HNSW_REBUILD_MIN_PDFS = int(os.getenv("HNSW_REBUILD_MIN_PDFS", "10"))
+
 # PostgreSQL Connection
 PG_CONNECTION_STRING = f"postgresql://{os.getenv('POSTGRES_USER', 'postgres')}:{os.getenv('POSTGRES_PASSWORD', '')}@{os.getenv('POSTGRES_HOST', 'localhost')}:{os.getenv('POSTGRES_PORT', '5432')}/{os.getenv('POSTGRES_DB', 'labia_db')}"
 
 # Logging Configuration
+# INFO: un resumen por PDF y por lote; LOG_LEVEL=DEBUG muestra el detalle por sección/chunk
 logging.basicConfig(
-    level=logging.INFO,
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
@@ -96,6 +188,21 @@ logger = logging.getLogger(__name__)
 # Unit Registry para normalización
 ureg = pint.UnitRegistry()
 
+def _compile_pattern(pattern: str, flags: int = 0):
+    """
+    Compila un patrón con RE2 si está disponible y el patrón es compatible; si no
+    (RE2 no instalado o construcciones sin soporte como lookaheads), usa re.
+    
+    Los objetos devueltos comparten la API usada aquí (search, findall, finditer, sub).
+    """
+    if RE2_AVAILABLE:
+        inline = ("i" if flags & re.IGNORECASE else "") + ("m" if flags & re.MULTILINE else "")
+        try:
+            return re2.compile(f"(?{inline}){pattern}" if inline else pattern)
+        except Exception:
+            pass
+    return re.compile(pattern, flags)
+
 # ================================================================================================
 # DICCIONARIO DE NORMALIZACIÓN DE UNIDADES
 # ================================================================================================
@@ -130,45 +237,423 @@ UNIT_PATTERNS = {
     r'(\d+\.?\d*)\s*gal': ('gallon', 'liter'),
 }
 
+def _unit_scale(from_unit: str, to_unit: str) -> Tuple[float, float]:
+    """
+    (factor, offset) tal que valor_destino = valor * factor + offset.
+    
+    Todas las conversiones de UNIT_PATTERNS son afines (el offset solo es distinto de 0
+    en temperaturas), así que basta evaluar pint en 0 y en 1 una vez por par de unidades.
+    """
+    zero = ureg.Quantity(0.0, from_unit).to(to_unit).magnitude
+    one = ureg.Quantity(1.0, from_unit).to(to_unit).magnitude
+    return one - zero, zero
+
+
+_UNIT_VALUE_PREFIX = r'(\d+\.?\d*)\s*'
+
+# Todas las unidades en UNA alternación (una sola pasada de finditer sobre el texto):
+# (?P<value>número)\s*(?:(?P<u0>°C)|(?P<u1>°F)|...). Las unidades más largas van primero
+# para que 'mm', 'mL' o 'MPa' no se lean como 'm', ni 'gal' como 'g'.
+_UNIT_SUFFIXES = sorted(
+    ((pattern[len(_UNIT_VALUE_PREFIX):], units) for pattern, units in UNIT_PATTERNS.items()),
+    key=lambda item: -len(item[0].split('(?')[0])
+)
+_UNIT_RE = _compile_pattern(
+    r'(?P<value>\d+\.?\d*)\s*(?:'
+    + '|'.join(f'(?P<u{i}>{suffix})' for i, (suffix, _) in enumerate(_UNIT_SUFFIXES))
+    + ')',
+    re.IGNORECASE
+)
+# Grupo -> (unidad origen, unidad destino, factor, offset), conversión precalculada
+_UNIT_CONVERSIONS = {
+    f'u{i}': (from_unit, to_unit, *_unit_scale(from_unit, to_unit))
+    for i, (_, (from_unit, to_unit)) in enumerate(_UNIT_SUFFIXES)
+}
+
+# Sondeo barato previo: todo patrón de UNIT_PATTERNS empieza con un número (\d+\.?\d*),
+# espacios opcionales y una unidad cuyo primer carácter está en esta clase
+_UNIT_PROBE_RE = _compile_pattern(r'\d\.?\s*[°"pmkcifgl]', re.IGNORECASE)
+
+# ================================================================================================
+# PATRONES DE LIMPIEZA (headers/footers)
+# ================================================================================================
+
+# Se aplican uno tras otro y en este orden: quitar "DOCUMENTO CONTROLADO" o "Página N de M"
+# puede dejar sola en su línea un número de página, que el patrón siguiente elimina.
+# Cada patrón lleva un literal (en minúsculas) que debe aparecer para que pueda coincidir:
+# con un `in` (búsqueda en C) se evita la pasada de regex cuando no hay nada que quitar.
+HEADER_FOOTER_PATTERNS = [
+    ('documento controlado', r'DOCUMENTO CONTROLADO'),
+    ('lazarus', r'LAZARUS[^\n]*(?=\n)'),  # Resto de la línea (solo si le sigue un salto)
+    ('página ', r'Página \d+ de \d+'),
+    (None, r'^\d+\s*$'),  # Números de página solitarios (sin literal: siempre)
+    ('___', r'_{3,}'),  # Líneas de guiones bajos
+    ('---', r'-{3,}'),  # Líneas de guiones
+]
+_HEADER_FOOTER_STEPS = [
+    (literal, _compile_pattern(pattern, re.MULTILINE | re.IGNORECASE))
+    for literal, pattern in HEADER_FOOTER_PATTERNS
+]
+_MULTI_NEWLINE_RE = _compile_pattern(r'\n{3,}')
+_MULTI_SPACE_RE = _compile_pattern(r'  +')
+
+# ================================================================================================
+# PATRONES DE METADATOS
+# ================================================================================================
+
+# Variables técnicas comunes en laboratorio
+VARIABLES_PATTERNS = [
+    r'\bpH\b', r'\bPa\b', r'\bPs\b', r'\bG\b', r'\bT\b', r'\bV\b',
+    r'gravedad específica', r'revenimiento', r'resistencia',
+    r'contenido de aire', r'viscosidad', r'densidad'
+]
+# Texto encontrado (en minúsculas) -> etiqueta, en el orden de VARIABLES_PATTERNS
+_VARIABLE_LABELS = {
+    pattern.replace(r'\b', '').lower(): pattern.replace(r'\b', '')
+    for pattern in VARIABLES_PATTERNS
+}
+
+# Una sola alternación con grupos con nombre: el texto se recorre una vez con finditer
+# y cada coincidencia se despacha por match.lastgroup.
+_META_RE = _compile_pattern(
+    # Código de documento: LL-CI-I-05, LLCCI05, LL-CII-20, etc.
+    r'(?P<codigo>LL[-\s]?C(?:I{1,2})[-\s]?I?[-\s]?\d{2,3})'
+    # Normas ASTM: ASTM C109, ASTM C1090, C143, etc.
+    r'|(?P<astm>ASTM\s+(?P<astm_code>[A-Z]\d{2,4}(?:-\d{2})?))'
+    # Revisión: rev01, rev02, edición 01, etc.
+    r'|(?P<rev>(?:rev|revisión|edición)\s*(?P<rev_num>\d{1,2}))'
+    # Fecha: 01/12/2023, 2023-12-01, etc.
+    r'|(?P<fecha>(?:fecha|date)[\s:]+(?P<fecha_val>\d{1,2}[/-]\d{1,2}[/-]\d{2,4}))'
+    r'|(?P<var>' + '|'.join(VARIABLES_PATTERNS) + ')',
+    re.IGNORECASE
+)
+
+# ================================================================================================
+# PATRONES DE SECCIONES
+# ================================================================================================
+
+# Encabezados de secciones comunes (al inicio de la línea): sección -> palabras clave
+SECTION_KEYWORDS = {
+    'OBJETIVO': ('OBJETIVO', 'PROPÓSITO'),
+    'ALCANCE': ('ALCANCE',),
+    'REQUISITOS': ('REQUISITOS', 'REQUERIMIENTOS'),
+    'MATERIALES': ('MATERIALES', 'REACTIVOS'),
+    'EQUIPOS': ('EQUIPOS', 'APARATOS', 'INSTRUMENTOS'),
+    'PROCEDIMIENTO': ('PROCEDIMIENTO',),
+    'CÁLCULOS': ('CÁLCULOS', 'FÓRMULAS', 'EXPRESIÓN'),
+    'RESULTADOS': ('RESULTADOS', 'INFORME'),
+    'PRECAUCIONES': ('PRECAUCIONES', 'SEGURIDAD', 'ADVERTENCIAS'),
+    'REFERENCIAS': ('REFERENCIAS', 'NORMAS'),
+}
+# Palabra clave (en mayúsculas) -> sección: despacho directo por diccionario
+_KEYWORD_TO_SECTION = {
+    keyword: section for section, keywords in SECTION_KEYWORDS.items() for keyword in keywords
+}
+# Una sola alternación con todas las palabras clave (en el orden de SECTION_KEYWORDS).
+# MULTILINE + [^\S\n]*: encabezado al inicio de cualquier línea, sin cruzar saltos de línea
+_SECTION_RE = _compile_pattern(
+    r'^[^\S\n]*(' + '|'.join(_KEYWORD_TO_SECTION) + ')',
+    re.IGNORECASE | re.MULTILINE
+)
+
 # ================================================================================================
 # CLASE: PDFExtractor - Extracción Multi-Librería
 # ================================================================================================
 
+_page_pool = None
+
+
+def _get_page_pool() -> ProcessPoolExecutor:
+    """
+    Pool de procesos para extraer páginas (o PDFs completos) en paralelo (se crea en el primer uso).
+    
+    Usa 'spawn' en lugar de fork: ingest también corre dentro de app.py (/vectorize),
+    un proceso con hilos, y hacer fork ahí puede heredar locks tomados.
+    """
+    global _page_pool
+    if _page_pool is None:
+        _page_pool = ProcessPoolExecutor(
+            max_workers=PDF_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _page_pool
+
+
+def shutdown_page_pool():
+    """Libera los procesos de extracción al terminar una ingesta."""
+    global _page_pool
+    if _page_pool is not None:
+        _page_pool.shutdown()
+        _page_pool = None
+
+
+def _page_ranges(n_pages: int, n_parts: int) -> List[range]:
+    """Divide las páginas [0, n_pages) en n_parts rangos contiguos."""
+    size = -(-n_pages // n_parts)  # ceil
+    return [range(start, min(start + size, n_pages)) for start in range(0, n_pages, size)]
+
+
+def _pdfplumber_page_tables(page) -> List[Dict[str, any]]:
+    """
+    Tablas de una página de pdfplumber como dicts livianos:
+    {'header': [...], 'rows': [[...], ...], 'page': n, 'idx': i}
+    (sin un DataFrame por tabla; process_tables arma lo que necesite).
+    """
+    tables = []
+    page_tables = page.extract_tables()
+    if page_tables:
+        for table_idx, table in enumerate(page_tables):
+            if table:
+                tables.append({
+                    'header': table[0],
+                    'rows': table[1:],
+                    'page': page.page_number,
+                    'idx': table_idx
+                })
+    return tables
+
+
+def _pdfplumber_pages(pdf_path: str, pages: range) -> Tuple[List[str], List[Dict[str, any]]]:
+    """Texto y tablas de un rango de páginas con pdfplumber (función de módulo: picklable)."""
+    import pdfplumber
+    full_text = []
+    tables = []
+    with pdfplumber.open(pdf_path, pages=[i + 1 for i in pages]) as pdf:
+        for page in pdf.pages:
+            # Extraer texto
+            text = page.extract_text()
+            if text:
+                full_text.append(f"\n--- Página {page.page_number} ---\n{text}")
+            
+            # Extraer tablas
+            tables.extend(_pdfplumber_page_tables(page))
+    return full_text, tables
+
+
+def _pymupdf_scan_pages(pdf_path: str, pages: range) -> Tuple[List[str], List[int]]:
+    """
+    Texto de un rango de páginas con PyMuPDF y las páginas (base 0) donde
+    PyMuPDF detecta al menos una tabla.
+    """
+    full_text = []
+    table_pages = []
+    with fitz.open(pdf_path) as doc:
+        for idx in pages:
+            page = doc[idx]
+            text = page.get_text("text", flags=PYMUPDF_TEXT_FLAGS)
+            if text.strip():
+                full_text.append(f"\n--- Página {idx + 1} ---\n{text}")
+            if page.find_tables().tables:
+                table_pages.append(idx)
+    return full_text, table_pages
+
+
+def _pymupdf_pages(pdf_path: str, pages: range) -> List[str]:
+    """Texto de un rango de páginas con PyMuPDF."""
+    full_text = []
+    with fitz.open(pdf_path) as doc:
+        for idx in pages:
+            text = doc[idx].get_text("text", flags=PYMUPDF_TEXT_FLAGS)
+            if text.strip():
+                full_text.append(f"\n--- Página {idx + 1} ---\n{text}")
+    return full_text
+
+
+def _ocr_cache_path(image) -> str:
+    """Ruta en caché del OCR de una página: hash blake2b de los píxeles + idioma + motor."""
+    engine = "tesserocr" if TESSEROCR_AVAILABLE else "pytesseract"
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{OCR_LANG}:{engine}:{image.mode}:{image.size}".encode())
+    digest.update(image.tobytes())
+    return os.path.join(OCR_CACHE_DIR, f"{digest.hexdigest()}.txt")
+
+
+def _ocr_cache_get(cache_path: str) -> Optional[str]:
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Caché de OCR ilegible ({cache_path}): {e}")
+        return None
+
+
+def _ocr_cache_put(cache_path: str, text: str):
+    try:
+        os.makedirs(OCR_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, cache_path)  # Atómico entre workers
+    except Exception as e:
+        logger.warning(f"No se pudo guardar el OCR en caché: {e}")
+
+
+_tess_api = None
+
+
+def _get_tess_api():
+    """
+    API de tesserocr perezosa, una por proceso (cada worker del pool carga el modelo
+    una sola vez y lo reutiliza para todas sus páginas). Se libera con End() al salir.
+    """
+    global _tess_api
+    if _tess_api is None:
+        from tesserocr import PyTessBaseAPI
+        _tess_api = PyTessBaseAPI(lang=OCR_LANG)
+        atexit.register(_tess_api.End)
+    return _tess_api
+
+
+def _ocr_pages(pdf_path: str, pages: range, thread_count: int = 1) -> List[str]:
+    """
+    OCR de un rango de páginas (rasteriza solo ese rango con Poppler a OCR_DPI, y reduce
+    a OCR_MAX_SIDE px las páginas de formato grande).
+    
+    Cada página rasterizada se busca primero en la caché de OCR (hash de sus píxeles):
+    hashear cuesta una fracción de lo que cuesta Tesseract, así que re-ingestas y páginas
+    repetidas entre documentos no vuelven a pasar por OCR.
+    
+    Las páginas sin caché pasan por tesserocr si está instalado (API en proceso, sin
+    archivos temporales). Si no, se guardan como un TIFF multipágina y pytesseract ejecuta
+    Tesseract UNA vez sobre él: el modelo 'spa' se carga una vez por rango y no por página.
+    Tesseract separa las páginas con form feed (\\f).
+    """
+    from PIL import Image
+    from pdf2image import convert_from_path
+    
+    images = convert_from_path(
+        pdf_path, dpi=OCR_DPI, first_page=pages.start + 1, last_page=pages.stop,
+        thread_count=thread_count
+    )
+    if not images:
+        return []
+    
+    for page_num, image in enumerate(images, pages.start + 1):
+        if max(image.size) > OCR_MAX_SIDE:
+            original_size = image.size
+            image.thumbnail((OCR_MAX_SIDE, OCR_MAX_SIDE), Image.LANCZOS)
+            logger.debug(f"  OCR pág. {page_num}: {original_size} → {image.size} px")
+    
+    cache_paths = [_ocr_cache_path(image) for image in images]
+    texts = [_ocr_cache_get(path) for path in cache_paths]
+    misses = [i for i, text in enumerate(texts) if text is None]
+    
+    if misses and TESSEROCR_AVAILABLE:
+        api = _get_tess_api()
+        for i in misses:
+            api.SetImage(images[i])
+            texts[i] = api.GetUTF8Text()
+            api.Clear()  # Sin estado del clasificador entre páginas
+            _ocr_cache_put(cache_paths[i], texts[i])
+    elif misses:
+        import pytesseract
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tiff_path = os.path.join(tmp_dir, "pages.tif")
+            images[misses[0]].save(
+                tiff_path, save_all=True, append_images=[images[i] for i in misses[1:]]
+            )
+            ocr_output = pytesseract.image_to_string(tiff_path, lang=OCR_LANG)
+        
+        ocr_texts = ocr_output.split("\f")
+        for n, i in enumerate(misses):
+            texts[i] = ocr_texts[n] if n < len(ocr_texts) else ""
+            _ocr_cache_put(cache_paths[i], texts[i])
+    
+    logger.debug(f"  OCR págs. {pages.start + 1}-{pages.stop}: {len(images) - len(misses)} en caché, {len(misses)} con Tesseract")
+    
+    full_text = []
+    for page_num, text in enumerate(texts, pages.start + 1):
+        if text.strip():
+            full_text.append(f"\n--- Página {page_num} (OCR) ---\n{text}")
+    return full_text
+
+
 class PDFExtractor:
     """
     Extrae texto, tablas y metadatos de PDFs técnicos usando múltiples librerías:
     1. pdfplumber (PRIORIDAD 1: tablas estructuradas)
     2. PyMuPDF/fitz (PRIORIDAD 2: texto nativo)
     3. pytesseract (FALLBACK: OCR para imágenes/diagramas)
+    
+    Con parallel=True, los PDFs de PARALLEL_MIN_PAGES páginas o más se reparten por
+    rangos de páginas entre PDF_WORKERS procesos.
     """
     
-    def __init__(self, pdf_path: str):
+    def __init__(self, pdf_path: str, parallel: bool = True):
         self.pdf_path = pdf_path
         self.filename = os.path.basename(pdf_path)
+        self.parallel = parallel
+        self._page_count = None
+    
+    @property
+    def page_count(self) -> int:
+        if self._page_count is None:
+            with fitz.open(self.pdf_path) as doc:
+                self._page_count = doc.page_count
+        return self._page_count
+    
+    def _use_pool(self) -> bool:
+        return self.parallel and PDF_WORKERS > 1 and self.page_count >= PARALLEL_MIN_PAGES
+    
+    def _map_pages(self, func, *args) -> list:
+        """Ejecuta func(pdf_path, rango, *args) sobre todas las páginas, en paralelo si conviene."""
+        if not self._use_pool():
+            return [func(self.pdf_path, range(self.page_count), *args)]
+        ranges = _page_ranges(self.page_count, PDF_WORKERS)
+        extra = [repeat(a) for a in args]
+        return list(_get_page_pool().map(func, repeat(self.pdf_path), ranges, *extra))
+        
+    def has_text_layer(self) -> bool:
+        """
+        Sondeo barato con PyMuPDF: ¿las primeras páginas tienen texto nativo suficiente?
         
-    def extract_with_pdfplumber(self) -> Tuple[str, List[pd.DataFrame]]:
+        Si es así el PDF es digital (no escaneado) y se extrae directo con PyMuPDF,
+        sin la pasada completa de pdfplumber.
+        """
+        try:
+            with fitz.open(self.pdf_path) as doc:
+                probe = range(min(PROBE_PAGES, doc.page_count))
+                if not probe:
+                    return False
+                words = sum(len(doc[i].get_text("words")) for i in probe)
+                return words / len(probe) > PROBE_MIN_WORDS_PER_PAGE
+        except Exception as e:
+            logger.warning(f"Sondeo PyMuPDF falló en {self.filename}: {e}")
+            return False
+    
+    def extract_native(self) -> Tuple[str, List[Dict[str, any]]]:
+        """
+        Camino rápido para PDFs digitales: texto con PyMuPDF y pdfplumber solo sobre
+        las páginas donde PyMuPDF detecta tablas.
+        """
+        try:
+            full_text = []
+            table_pages = []
+            for part_text, part_tables in self._map_pages(_pymupdf_scan_pages):
+                full_text.extend(part_text)
+                table_pages.extend(part_tables)
+            
+            tables = []
+            if table_pages:
+                import pdfplumber
+                with pdfplumber.open(self.pdf_path, pages=[i + 1 for i in table_pages]) as pdf:
+                    for page in pdf.pages:
+                        tables.extend(_pdfplumber_page_tables(page))
+            return "\n".join(full_text), tables
+        except Exception as e:
+            logger.warning(f"Extracción nativa falló en {self.filename}: {e}")
+            return "", []
+    
+    def extract_with_pdfplumber(self) -> Tuple[str, List[Dict[str, any]]]:
         """Extrae texto y tablas con pdfplumber (mejor para tablas)."""
         try:
             full_text = []
             tables = []
-            
-            with pdfplumber.open(self.pdf_path) as pdf:
-                for page_num, page in enumerate(pdf.pages, 1):
-                    # Extraer texto
-                    text = page.extract_text()
-                    if text:
-                        full_text.append(f"\n--- Página {page_num} ---\n{text}")
-                    
-                    # Extraer tablas
-                    page_tables = page.extract_tables()
-                    if page_tables:
-                        for table_idx, table in enumerate(page_tables):
-                            if table:
-                                df = pd.DataFrame(table[1:], columns=table[0] if table[0] else None)
-                                df['_page'] = page_num
-                                df['_table_idx'] = table_idx
-                                tables.append(df)
-            
+            for part_text, part_tables in self._map_pages(_pdfplumber_pages):
+                full_text.extend(part_text)
+                tables.extend(part_tables)
             return "\n".join(full_text), tables
         except Exception as e:
             logger.warning(f"pdfplumber falló en {self.filename}: {e}")
@@ -177,16 +662,7 @@ class PDFExtractor:
     def extract_with_pymupdf(self) -> str:
         """Extrae texto con PyMuPDF/fitz (mejor para texto nativo)."""
         try:
-            doc = fitz.open(self.pdf_path)
-            full_text = []
-            
-            for page_num, page in enumerate(doc, 1):
-                text = page.get_text()
-                if text.strip():
-                    full_text.append(f"\n--- Página {page_num} ---\n{text}")
-            
-            doc.close()
-            return "\n".join(full_text)
+            return "\n".join(t for part in self._map_pages(_pymupdf_pages) for t in part)
         except Exception as e:
             logger.warning(f"PyMuPDF falló en {self.filename}: {e}")
             return ""
@@ -199,28 +675,40 @@ class PDFExtractor:
         
         try:
             logger.info(f"Aplicando OCR a {self.filename}...")
-            images = convert_from_path(self.pdf_path)
-            full_text = []
-            
-            for page_num, image in enumerate(images, 1):
-                text = pytesseract.image_to_string(image, lang='spa')
-                if text.strip():
-                    full_text.append(f"\n--- Página {page_num} (OCR) ---\n{text}")
-            
-            return "\n".join(full_text)
+            # En serie, Poppler rasteriza con varios hilos; en paralelo, un hilo por proceso
+            thread_count = 1 if self._use_pool() else PDF_WORKERS
+            return "\n".join(t for part in self._map_pages(_ocr_pages, thread_count) for t in part)
         except Exception as e:
             logger.error(f"OCR falló en {self.filename}: {e}")
             return ""
     
-    def extract_all(self) -> Tuple[str, List[pd.DataFrame]]:
+    def extract_all(self) -> Tuple[str, List[Dict[str, any]]]:
+        """
+        Extrae texto y tablas usando el caché (memoria + disco) si el PDF no cambió.
+        
+        La clave es (ruta absoluta, mtime_ns, tamaño, EXTRACTION_CACHE_VERSION).
+        """
+        cache_key = _extraction_cache_key(self.pdf_path)
+        return _extract_cached(cache_key, self.pdf_path, self.parallel)
+    
+    def extract_uncached(self) -> Tuple[str, List[Dict[str, any]]]:
         """
         Estrategia de extracción con fallback:
+        0. Si el sondeo detecta capa de texto: PyMuPDF + pdfplumber solo en páginas con tablas
         1. Intentar pdfplumber (mejor para tablas)
         2. Si falla o texto insuficiente, intentar PyMuPDF
         3. Si ambos fallan, intentar OCR (solo si OCR_AVAILABLE=True)
         """
         logger.info(f"📄 Procesando: {self.filename}")
         
+        # Intento 0: camino rápido para PDFs digitales
+        if self.has_text_layer():
+            logger.info(f"  ↳ PDF con texto nativo, extracción directa con PyMuPDF...")
+            text, tables = self.extract_native()
+            if len(text) >= 100:
+                logger.info(f"  ✓ Extraído: {len(text)} caracteres, {len(tables)} tablas")
+                return text, tables
+        
         # Intento 1: pdfplumber
         text, tables = self.extract_with_pdfplumber()
         
@@ -241,6 +729,45 @@ class PDFExtractor:
         logger.info(f"  ✓ Extraído: {len(text)} caracteres, {len(tables)} tablas")
         return text, tables
 
+
+def _extraction_cache_key(pdf_path: str) -> str:
+    stat = os.stat(pdf_path)
+    raw = f"{os.path.abspath(pdf_path)}:{stat.st_mtime_ns}:{stat.st_size}:{EXTRACTION_CACHE_VERSION}"
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+@functools.lru_cache(maxsize=64)
+def _extract_cached(cache_key: str, pdf_path: str, parallel: bool) -> Tuple[str, List[Dict[str, any]]]:
+    """
+    Resultado de PDFExtractor.extract_uncached() cacheado en memoria (LRU) y en disco (pickle).
+    
+    Las extracciones sin texto no se guardan en disco, así un PDF que falló (p.ej. sin OCR
+    instalado) se vuelve a intentar en la siguiente ingesta.
+    """
+    cache_path = os.path.join(EXTRACTION_CACHE_DIR, f"{cache_key}.pkl")
+    try:
+        with open(cache_path, "rb") as f:
+            text, tables = pickle.load(f)
+        logger.info(f"📦 Extracción en caché: {os.path.basename(pdf_path)}")
+        return text, tables
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"Caché de extracción ilegible ({cache_path}): {e}")
+
+    text, tables = PDFExtractor(pdf_path, parallel=parallel).extract_uncached()
+
+    if text:
+        try:
+            os.makedirs(EXTRACTION_CACHE_DIR, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump((text, tables), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)  # Atómico: nunca queda un pickle a medias
+        except Exception as e:
+            logger.warning(f"No se pudo guardar la extracción en caché: {e}")
+    return text, tables
+
 # ================================================================================================
 # FUNCIONES: Limpieza y Normalización
 # ================================================================================================
@@ -252,21 +779,18 @@ def clean_headers_footers(text: str) -> str:
     - Logos
     - Pies de página con números
     """
-    patterns_to_remove = [
-        r'DOCUMENTO CONTROLADO',
-        r'LAZARUS.*?(?=\n)',
-        r'Página \d+ de \d+',
-        r'^\d+\s*$',  # Números de página solitarios
-        r'_{3,}',  # Líneas de guiones bajos
-        r'-{3,}',  # Líneas de guiones
-    ]
-    
-    for pattern in patterns_to_remove:
-        text = re.sub(pattern, '', text, flags=re.MULTILINE | re.IGNORECASE)
+    # Sondeo barato con `in` (búsqueda en C, sin regex) antes de cada patrón; el texto en
+    # minúsculas solo se recalcula si un patrón quitó algo
+    lowered = text.lower()
+    for literal, pattern in _HEADER_FOOTER_STEPS:
+        if literal is None or literal in lowered:
+            text, n_removed = pattern.subn('', text)
+            if n_removed:
+                lowered = text.lower()
     
     # Limpiar espacios múltiples
-    text = re.sub(r'\n{3,}', '\n\n', text)
-    text = re.sub(r'  +', ' ', text)
+    text = _MULTI_NEWLINE_RE.sub('\n\n', text)
+    text = _MULTI_SPACE_RE.sub(' ', text)
     
     return text.strip()
 
@@ -277,26 +801,21 @@ def normalize_units(text: str) -> Dict[str, any]:
     """
     normalized_units = []
     
-    for pattern, (from_unit, to_unit) in UNIT_PATTERNS.items():
-        matches = re.finditer(pattern, text, re.IGNORECASE)
-        for match in matches:
-            value_str = match.group(1)
-            original = match.group(0)
-            
-            try:
-                value = float(value_str)
-                quantity = value * ureg(from_unit)
-                converted = quantity.to(to_unit)
-                
-                normalized_units.append({
-                    'original': original,
-                    'value_original': value,
-                    'unit_original': from_unit,
-                    'value_normalized': f"{converted.magnitude:.2f}",
-                    'unit_normalized': to_unit
-                })
-            except Exception as e:
-                logger.debug(f"Error normalizando '{original}': {e}")
+    # Sondeo: sin ningún número seguido de un posible símbolo de unidad no hay nada que
+    # normalizar y se evita la pasada de la alternación completa
+    if not _UNIT_PROBE_RE.search(text):
+        return normalized_units
+    
+    for match in _UNIT_RE.finditer(text):
+        from_unit, to_unit, factor, offset = _UNIT_CONVERSIONS[match.lastgroup]
+        value = float(match.group('value'))
+        normalized_units.append({
+            'original': match.group(0),
+            'value_original': value,
+            'unit_original': from_unit,
+            'value_normalized': f"{value * factor + offset:.2f}",
+            'unit_normalized': to_unit
+        })
     
     return normalized_units
 
@@ -323,46 +842,29 @@ def extract_metadata(text: str, filename: str) -> Dict[str, any]:
         'tipo_documento': 'instructivo_laboratorio'
     }
     
-    # Código de documento: LL-CI-I-05, LLCCI05, LL-CII-20, etc.
-    codigo_match = re.search(r'(LL[-\s]?C(?:I{1,2})[-\s]?I?[-\s]?\d{2,3})', text, re.IGNORECASE)
-    if codigo_match:
-        metadata['codigo_documento'] = codigo_match.group(1).replace(' ', '').upper()
+    astm = set()
+    variables = set()
     
-    # Normas ASTM: ASTM C109, ASTM C1090, C143, etc.
-    astm_matches = re.findall(r'ASTM\s+([A-Z]\d{2,4}(?:-\d{2})?)', text, re.IGNORECASE)
-    if astm_matches:
-        metadata['normas_astm'] = list(set(astm_matches))
+    for match in _META_RE.finditer(text):
+        kind = match.lastgroup
+        if kind == 'var':
+            variables.add(match.group('var').lower())
+        elif kind == 'astm':
+            astm.add(match.group('astm_code'))
+        elif kind == 'codigo':
+            if metadata['codigo_documento'] is None:
+                metadata['codigo_documento'] = match.group('codigo').replace(' ', '').upper()
+        elif kind == 'rev':
+            if metadata['revision'] is None:
+                metadata['revision'] = f"rev{match.group('rev_num').zfill(2)}"
+        elif kind == 'fecha':
+            if metadata['fecha'] is None:
+                metadata['fecha'] = match.group('fecha_val')
     
-    # Revisión: rev01, rev02, edición 01, etc.
-    revision_match = re.search(r'(?:rev|revisión|edición)\s*(\d{1,2})', text, re.IGNORECASE)
-    if revision_match:
-        metadata['revision'] = f"rev{revision_match.group(1).zfill(2)}"
-    
-    # Fecha: 01/12/2023, 2023-12-01, etc.
-    fecha_match = re.search(r'(?:fecha|date)[\s:]+(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})', text, re.IGNORECASE)
-    if fecha_match:
-        metadata['fecha'] = fecha_match.group(1)
-    
-    # Variables técnicas comunes en laboratorio
-    variables_patterns = [
-        r'\bpH\b', r'\bPa\b', r'\bPs\b', r'\bG\b', r'\bT\b', r'\bV\b',
-        r'gravedad específica', r'revenimiento', r'resistencia',
-        r'contenido de aire', r'viscosidad', r'densidad'
-    ]
-    for pattern in variables_patterns:
-        if re.search(pattern, text, re.IGNORECASE):
-            metadata['variables_tecnicas'].append(pattern.replace(r'\b', ''))
-    
-    return metadata
-    # Variables técnicas comunes en laboratorio
-    variables_patterns = [
-        r'\bpH\b', r'\bPa\b', r'\bPs\b', r'\bG\b', r'\bT\b', r'\bV\b',
-        r'gravedad específica', r'revenimiento', r'resistencia',
-        r'contenido de aire', r'viscosidad', r'densidad'
+    metadata['normas_astm'] = list(astm)
+    metadata['variables_tecnicas'] = [
+        label for key, label in _VARIABLE_LABELS.items() if key in variables
     ]
-    for pattern in variables_patterns:
-        if re.search(pattern, text, re.IGNORECASE):
-            metadata['variables_tecnicas'].append(pattern.replace(r'\b', ''))
     
     return metadata
 
@@ -382,95 +884,166 @@ def segment_by_sections(text: str) -> List[Dict[str, str]]:
     """
     sections = []
     
-    # Patrones de secciones comunes
-    section_patterns = {
-        'OBJETIVO': r'(?:OBJETIVO|PROPÓSITO)',
-        'ALCANCE': r'ALCANCE',
-        'REQUISITOS': r'(?:REQUISITOS|REQUERIMIENTOS)',
-        'MATERIALES': r'(?:MATERIALES|REACTIVOS)',
-        'EQUIPOS': r'(?:EQUIPOS|APARATOS|INSTRUMENTOS)',
-        'PROCEDIMIENTO': r'PROCEDIMIENTO',
-        'CÁLCULOS': r'(?:CÁLCULOS|FÓRMULAS|EXPRESIÓN)',
-        'RESULTADOS': r'(?:RESULTADOS|INFORME)',
-        'PRECAUCIONES': r'(?:PRECAUCIONES|SEGURIDAD|ADVERTENCIAS)',
-        'REFERENCIAS': r'(?:REFERENCIAS|NORMAS)',
-    }
-    
-    # Dividir por secciones
+    # Dividir por secciones: una sola pasada de finditer sobre todo el texto encuentra los
+    # encabezados y cada sección se obtiene con un slice entre encabezados consecutivos
     current_section = 'INICIO'
-    current_text = []
-    
-    for line in text.split('\n'):
-        matched_section = None
-        for section_name, pattern in section_patterns.items():
-            if re.search(f'^\\s*{pattern}', line, re.IGNORECASE):
-                # Guardar sección anterior
-                if current_text:
-                    sections.append({
-                        'seccion': current_section,
-                        'contenido': '\n'.join(current_text)
-                    })
-                current_section = section_name
-                current_text = [line]
-                matched_section = True
-                break
-        
-        if not matched_section:
-            current_text.append(line)
+    section_start = 0
+    
+    for match in _SECTION_RE.finditer(text):
+        # Guardar sección anterior (sin el salto de línea que la separa del encabezado)
+        if match.start() > section_start:
+            sections.append({
+                'seccion': current_section,
+                'contenido': text[section_start:match.start() - 1]
+            })
+        current_section = _KEYWORD_TO_SECTION[match.group(1).upper()]
+        section_start = match.start()
     
     # Guardar última sección
-    if current_text:
-        sections.append({
-            'seccion': current_section,
-            'contenido': '\n'.join(current_text)
-        })
+    sections.append({
+        'seccion': current_section,
+        'contenido': text[section_start:]
+    })
     
     return sections
 
+def merge_small_sections(sections: List[Dict[str, str]],
+                         min_chars: int = CHUNK_MERGE_MIN_CHARS) -> List[Dict[str, str]]:
+    """
+    Une cada sección con menos de min_chars (p.ej. "OBJETIVO\nDeterminar el pH del
+    cemento.") al inicio de la sección siguiente; la última, si es chica, va al final de la
+    anterior. La unión conserva el nombre de la parte más larga.
+    
+    Se hace sobre el texto de las secciones, antes del splitter: así una sección corta
+    termina dentro de un chunk con contexto en vez de quedar como chunk suelto.
+    """
+    merged = []
+    pending = None  # Sección chica que espera a la siguiente
+    for section in sections:
+        contenido = section['contenido'].strip()
+        if not contenido:
+            continue
+        current = {'seccion': section['seccion'], 'contenido': contenido}
+        if pending is not None:
+            current = {
+                'seccion': max(pending, current, key=lambda s: len(s['contenido']))['seccion'],
+                'contenido': f"{pending['contenido']}\n{contenido}"
+            }
+            pending = None
+        if len(current['contenido']) < min_chars:
+            pending = current
+        else:
+            merged.append(current)
+    
+    if pending is not None:
+        if merged:
+            previous = merged[-1]
+            merged[-1] = {
+                'seccion': max(previous, pending, key=lambda s: len(s['contenido']))['seccion'],
+                'contenido': f"{previous['contenido']}\n{pending['contenido']}"
+            }
+        else:
+            merged.append(pending)
+    return merged
+
+def _overlap_len(previous: str, chunk: str, max_overlap: int = CHUNK_OVERLAP) -> int:
+    """
+    Largo del prefijo de chunk que repite el final de previous (el overlap del splitter),
+    o 0 si la coincidencia es más corta que CHUNK_MERGE_MIN_OVERLAP.
+    """
+    for size in range(min(max_overlap, len(previous), len(chunk)), CHUNK_MERGE_MIN_OVERLAP - 1, -1):
+        if previous.endswith(chunk[:size]):
+            return size
+    return 0
+
+def merge_small_chunks(chunks: List[str], min_chars: int = CHUNK_MERGE_MIN_CHARS,
+                       max_chars: int = CHUNK_SIZE) -> List[str]:
+    """
+    Une chunks consecutivos (de una misma sección) cuando alguno de los dos tiene menos de
+    min_chars y la unión no pasa de max_chars. Menos chunks pobres en contexto: menos
+    llamadas a embeddings y menos resultados desperdiciados en la búsqueda.
+    
+    El overlap que el splitter repite al inicio del chunk siguiente se quita al unir, y
+    como la unión nunca supera max_chars (CHUNK_SIZE) no hace falta volver a partirla.
+    """
+    merged = []
+    for chunk in chunks:
+        if merged:
+            previous = merged[-1]
+            small = len(previous.strip()) < min_chars or len(chunk.strip()) < min_chars
+            overlap = _overlap_len(previous, chunk)
+            joined = previous + chunk[overlap:] if overlap else f"{previous}\n{chunk}"
+            if small and len(joined) <= max_chars:
+                merged[-1] = joined
+                continue
+        merged.append(chunk)
+    return merged
+
+def is_embeddable_chunk(chunk: str) -> bool:
+    """
+    ¿Vale la pena generar el embedding de este chunk de texto?
+    Descarta vacíos, los de menos de MIN_CHUNK_CHARS caracteres útiles y los que tienen
+    menos de MIN_CHUNK_ALPHA_RATIO de letras. Las tablas no pasan por aquí (son casi
+    todo números).
+    
+    Se aplica después de merge_small_sections/merge_small_chunks, y un chunk que empieza
+    con un encabezado de sección no pasa por el filtro de largo: una sección corta que no
+    se pudo unir (p.ej. el único contenido del PDF) es información real, no ruido.
+    """
+    content = chunk.strip() if chunk else ''
+    if not content:
+        return False
+    if len(content) < MIN_CHUNK_CHARS and not _SECTION_RE.match(content):
+        return False
+    return sum(map(str.isalpha, content)) / len(content) >= MIN_CHUNK_ALPHA_RATIO
+
 # ================================================================================================
 # FUNCIONES: Procesamiento de Tablas
 # ================================================================================================
 
-def process_tables(tables: List[pd.DataFrame]) -> List[Dict[str, any]]:
+def _table_cell(value) -> str:
+    """Celda de tabla como texto de una línea (None → vacío, como to_markdown)."""
+    if value is None:
+        return ""
+    return str(value).replace("\n", " ")
+
+
+def process_tables(tables: List[Dict[str, any]]) -> List[Dict[str, any]]:
     """
     Convierte tablas a formato textual estructurado.
     Las tablas se guardan como chunks únicos (no se dividen).
     """
     processed_tables = []
     
-    for idx, df in enumerate(tables):
+    for idx, table in enumerate(tables):
         try:
             # Validar que la tabla tenga datos
-            if df.empty:
-                logger.warning(f"      ⚠️  Tabla {idx} vacía - SKIP")
+            if not table['rows']:
+                logger.debug(f"      ⚠️  Tabla {idx} vacía - SKIP")
                 continue
             
-            # Convertir tabla a texto markdown
-            table_text = df.to_markdown(index=False)
+            # Convertir tabla a texto markdown directamente (sin DataFrame ni el padding
+            # de tabulate: para los embeddings solo importan los tokens)
+            columns = table['header'] or list(range(len(table['rows'][0])))
+            lines = [
+                " | ".join(_table_cell(c) for c in columns),
+                " | ".join(["---"] * len(columns))
+            ]
+            lines.extend(" | ".join(_table_cell(c) for c in row) for row in table['rows'])
+            table_text = "\n".join(lines)
             
             # Validar que el texto generado tenga contenido
             if not table_text or not table_text.strip():
-                logger.warning(f"      ⚠️  Tabla {idx} sin contenido de texto - SKIP")
+                logger.debug(f"      ⚠️  Tabla {idx} sin contenido de texto - SKIP")
                 continue
             
-            # Extraer metadatos de la tabla de forma segura
-            page_num = None
-            if '_page' in df.columns:
-                try:
-                    # Usar iloc para acceso seguro al primer elemento
-                    page_series = df['_page']
-                    if len(page_series) > 0:
-                        page_num = page_series.iloc[0]
-                except Exception:
-                    pass  # Si falla, page_num queda como None
-            
             processed_tables.append({
                 'contenido': table_text,
                 'tipo_contenido': 'tabla',
                 'tabla_idx': idx,
-                'page': page_num,
-                'columnas': list(df.columns),
-                'filas': len(df)
+                'page': table['page'],
+                'columnas': list(columns),
+                'filas': len(table['rows'])
             })
             
         except Exception as e:
@@ -479,6 +1052,247 @@ def process_tables(tables: List[pd.DataFrame]) -> List[Dict[str, any]]:
     
     return processed_tables
 
+# ================================================================================================
+# CLASE: AsyncBatchEmbedder - Embeddings por lotes en paralelo
+# ================================================================================================
+
+class AsyncBatchEmbedder(Embeddings):
+    """
+    Embeddings de Google Gemini vía REST batchEmbedContents, con varios lotes en vuelo.
+    
+    Divide los textos en lotes de EMBED_BATCH_SIZE y los envía en paralelo con un
+    httpx.AsyncClient persistente (HTTP/2, conexión multiplexada y reutilizada entre
+    llamadas), limitados por un semáforo de EMBED_CONCURRENCY requests para respetar
+    la cuota. La latencia total
+    pasa de (lotes × RTT) a aproximadamente (lotes / concurrencia × RTT).
+    Los lotes que reciben 429/5xx o errores de red se reintentan con backoff exponencial.
+    
+    Implementa la interfaz Embeddings de LangChain, así PGVector.add_documents la usa
+    directamente. Mismo modelo y task_type que GoogleGenerativeAIEmbeddings.
+    """
+    
+    API_BASE = "https://generativelanguage.googleapis.com/v1beta"
+    RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+    
+    def __init__(self, model: str = "models/embedding-001", api_key: Optional[str] = None,
+                 batch_size: int = EMBED_BATCH_SIZE, concurrency: int = EMBED_CONCURRENCY):
+        self.model = model
+        self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        # Loop y cliente propios, creados en el primer uso y reutilizados entre llamadas:
+        # las conexiones HTTP/2 (TLS ya negociado) sobreviven de un flush al siguiente
+        self._loop = None
+        self._client = None
+        self._lock = threading.Lock()  # Un loop no puede correr en dos hilos a la vez
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=True,
+                verify=ssl_context,  # Bypass SSL corporate proxy
+                timeout=httpx.Timeout(connect=10.0, read=120.0, write=30.0, pool=None),
+                limits=httpx.Limits(max_connections=32, max_keepalive_connections=8),
+                headers={"x-goog-api-key": self.api_key}
+            )
+        return self._client
+    
+    def _run(self, coro):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+            return self._loop.run_until_complete(coro)
+    
+    async def _embed_batch(self, client: httpx.AsyncClient, semaphore: asyncio.Semaphore,
+                           texts: List[str], task_type: str) -> List[List[float]]:
+        payload = {
+            "requests": [
+                {"model": self.model, "content": {"parts": [{"text": t}]}, "taskType": task_type}
+                for t in texts
+            ]
+        }
+        url = f"{self.API_BASE}/{self.model}:batchEmbedContents"
+        for attempt in range(EMBED_MAX_RETRIES + 1):
+            try:
+                async with semaphore:
+                    response = await client.post(url, json=payload)
+            except httpx.TransportError as e:
+                if attempt == EMBED_MAX_RETRIES:
+                    raise
+                retry_reason, retry_after = str(e), None
+            else:
+                if response.status_code not in self.RETRYABLE_STATUS or attempt == EMBED_MAX_RETRIES:
+                    response.raise_for_status()
+                    return [e["values"] for e in response.json()["embeddings"]]
+                retry_reason, retry_after = f"HTTP {response.status_code}", response.headers.get("Retry-After")
+            
+            # Backoff exponencial (o Retry-After si la API lo indica), fuera del semáforo
+            # para no ocupar un cupo de concurrencia mientras se espera
+            delay = EMBED_RETRY_BASE_DELAY * 2 ** attempt
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            logger.warning(f"⚠️ Lote de embeddings falló ({retry_reason}), reintento {attempt + 1}/{EMBED_MAX_RETRIES} en {delay:.0f}s")
+            await asyncio.sleep(delay)
+    
+    async def _embed_all(self, texts: List[str], task_type: str) -> List[List[float]]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        client = self._get_client()
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        results = await asyncio.gather(
+            *(self._embed_batch(client, semaphore, batch, task_type) for batch in batches)
+        )
+        return [vector for batch_vectors in results for vector in batch_vectors]
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self._run(self._embed_all(list(texts), "RETRIEVAL_DOCUMENT"))
+    
+    def embed_query(self, text: str) -> List[float]:
+        return self._run(self._embed_all([text], "RETRIEVAL_QUERY"))[0]
+    
+    def close(self):
+        """Cierra el cliente HTTP y el loop (al terminar la ingesta)."""
+        with self._lock:
+            if self._loop is None:
+                return
+            if self._client is not None:
+                self._loop.run_until_complete(self._client.aclose())
+                self._client = None
+            self._loop.close()
+            self._loop = None
+
+# ================================================================================================
+# ALMACENAMIENTO: Carga masiva de embeddings
+# ================================================================================================
+
+@functools.lru_cache(maxsize=None)
+def _collection_uuid(collection_name: str) -> uuid.UUID:
+    """UUID de la colección en langchain_pg_collection (se consulta una vez por proceso)."""
+    with database.pg_connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT uuid FROM langchain_pg_collection WHERE name = %s", (collection_name,))
+        row = cursor.fetchone()
+    if row is None:
+        raise RuntimeError(f"La colección '{collection_name}' no existe")
+    return uuid.UUID(str(row[0]))
+
+
+_copy_conn = None
+
+
+def _get_copy_connection():
+    """
+    Conexión psycopg 3 para el COPY, abierta una vez y reutilizada entre lotes
+    (sin handshake TCP/TLS/auth por flush). La usa solo el hilo de carga del ingest.
+    """
+    global _copy_conn
+    if _copy_conn is None or _copy_conn.closed or _copy_conn.broken:
+        _copy_conn = psycopg.connect(PG_CONNECTION_STRING, autocommit=True)
+        register_vector(_copy_conn)
+    return _copy_conn
+
+
+def close_copy_connection():
+    """Cierra la conexión del COPY al terminar la ingesta."""
+    global _copy_conn
+    if _copy_conn is not None:
+        _copy_conn.close()
+        _copy_conn = None
+
+
+def copy_embeddings(documents: List[Document], vectors: List[List[float]]) -> int:
+    """
+    Inserta documentos + embeddings en langchain_pg_embedding con COPY ... FORMAT BINARY.
+    
+    Un solo stream por lote en lugar de un INSERT por chunk; los vectores viajan en el
+    formato binario de pgvector (sin serializar a texto). Escribe en la misma colección
+    y con el mismo esquema que PGVector (id uuid4 como texto, cmetadata JSONB).
+    
+    Los vectores se convierten a una sola matriz float32 contigua; cada fila del COPY
+    es una vista sobre ella (sin un np.asarray por chunk).
+    
+    Returns:
+        Número de filas copiadas
+    """
+    collection_id = _collection_uuid(COLLECTION_NAME)
+    matrix = np.asarray(vectors, dtype=np.float32)
+    
+    conn = _get_copy_connection()
+    with conn.transaction():
+        with conn.cursor() as cursor:
+            with cursor.copy(
+                """COPY langchain_pg_embedding (id, collection_id, embedding, document, cmetadata)
+                   FROM STDIN WITH (FORMAT BINARY)"""
+            ) as copy:
+                copy.set_types(["varchar", "uuid", "vector", "text", "jsonb"])
+                for doc, vector in zip(documents, matrix):
+                    copy.write_row((
+                        str(uuid.uuid4()),
+                        collection_id,
+                        vector,
+                        doc.page_content,
+                        Jsonb(doc.metadata)
+                    ))
+    return len(documents)
+
+
+def _vector_literal(vector: List[float]) -> str:
+    """Literal de texto de pgvector ('[0.1,0.2,...]') serializado en C con json.dumps."""
+    return json.dumps(vector, separators=(',', ':'))
+
+
+def insert_embeddings(documents: List[Document], vectors: List[List[float]]) -> int:
+    """
+    Respaldo de copy_embeddings sin psycopg 3: INSERT multi-VALUES con execute_values
+    (INSERT_PAGE_SIZE filas por sentencia) en lugar del INSERT por fila de PGVector.
+    
+    Toma una conexión del pool y desactiva su statement_timeout solo en esta transacción:
+    un lote grande con el índice HNSW presente puede tardar más que una consulta del chat.
+    
+    Returns:
+        Número de filas insertadas
+    """
+    collection_id = str(_collection_uuid(COLLECTION_NAME))
+    rows = [
+        (
+            str(uuid.uuid4()),
+            collection_id,
+            _vector_literal(vector),
+            doc.page_content,
+            Json(doc.metadata)
+        )
+        for doc, vector in zip(documents, vectors)
+    ]
+    
+    with database.pg_connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SET LOCAL statement_timeout = 0")
+        execute_values(
+            cursor,
+            """INSERT INTO langchain_pg_embedding (id, collection_id, embedding, document, cmetadata)
+               VALUES %s""",
+            rows,
+            template="(%s, %s::uuid, %s::vector, %s, %s)",
+            page_size=INSERT_PAGE_SIZE
+        )
+        conn.commit()
+    return len(rows)
+
+
+def store_documents(documents: List[Document], embeddings: Embeddings) -> int:
+    """
+    Genera los embeddings y los guarda: COPY binario si está disponible; si no (o si
+    falla), INSERT por páginas con execute_values reutilizando los vectores ya calculados.
+    """
+    vectors = embeddings.embed_documents([d.page_content for d in documents])
+    
+    if COPY_AVAILABLE:
+        try:
+            return copy_embeddings(documents, vectors)
+        except Exception as e:
+            logger.warning(f"  ⚠️ COPY falló, usando INSERT por páginas: {e}")
+    
+    return insert_embeddings(documents, vectors)
+
 # ================================================================================================
 # FUNCIÓN PRINCIPAL: Ingestar PDFs
 # ================================================================================================
@@ -491,30 +1305,215 @@ def reset_vectorstore():
     """
     logger.warning("⚠️  LIMPIANDO COLECCIÓN DE EMBEDDINGS...")
     try:
-        conn = database.get_pg_connection()
-        cursor = conn.cursor()
+        with database.pg_connection() as conn, conn.cursor() as cursor:
+            # Borrado masivo: sin el statement_timeout del pool en esta transacción
+            cursor.execute("SET LOCAL statement_timeout = 0")
+            
+            # Eliminar todos los embeddings de la colección
+            cursor.execute(
+                """DELETE FROM langchain_pg_embedding 
+                   WHERE collection_id = (
+                       SELECT uuid FROM langchain_pg_collection WHERE name = %s
+                   )""",
+                (COLLECTION_NAME,)
+            )
+            deleted_count = cursor.rowcount
+            conn.commit()
         
-        # Eliminar todos los embeddings de la colección
+        logger.info(f"✅ Eliminados {deleted_count} documentos de la colección '{COLLECTION_NAME}'")
+        logger.info("🔄 La colección está lista para una ingesta limpia")
+    except Exception as e:
+        logger.error(f"❌ Error limpiando colección: {e}")
+
+
+def _file_sha1(pdf_path: str) -> str:
+    """SHA-1 del contenido del PDF (identifica el archivo aunque cambie de nombre o mtime)."""
+    with open(pdf_path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha1').hexdigest()
+
+
+def ingested_hashes() -> set:
+    """SHA-1 de los PDFs que ya tienen chunks en la colección (cmetadata->>'file_sha1')."""
+    with database.pg_connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SET LOCAL statement_timeout = 0")
         cursor.execute(
-            """DELETE FROM langchain_pg_embedding 
-               WHERE collection_id = (
-                   SELECT uuid FROM langchain_pg_collection WHERE name = %s
-               )""",
+            """SELECT DISTINCT e.cmetadata->>'file_sha1'
+               FROM langchain_pg_embedding e
+               JOIN langchain_pg_collection c ON c.uuid = e.collection_id
+               WHERE c.name = %s AND e.cmetadata ? 'file_sha1'""",
             (COLLECTION_NAME,)
         )
+        hashes = {row[0] for row in cursor.fetchall()}
+        conn.commit()
+    return hashes
+
+
+def delete_documents_by_source(sources: List[str]) -> int:
+    """
+    Borra los chunks de estos archivos (cmetadata->>'source') antes de re-ingestarlos,
+    para que un PDF modificado no deje sus chunks viejos duplicados.
+    """
+    with database.pg_connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SET LOCAL statement_timeout = 0")
+        cursor.execute(
+            """DELETE FROM langchain_pg_embedding
+               WHERE collection_id = (SELECT uuid FROM langchain_pg_collection WHERE name = %s)
+                 AND cmetadata->>'source' = ANY(%s)""",
+            (COLLECTION_NAME, list(sources))
+        )
         deleted_count = cursor.rowcount
-        
         conn.commit()
-        cursor.close()
-        conn.close()
-        
-        logger.info(f"✅ Eliminados {deleted_count} documentos de la colección '{COLLECTION_NAME}'")
-        logger.info("🔄 La colección está lista para una ingesta limpia")
+    return deleted_count
+
+
+def extract_and_chunk(pdf_path: str, parallel: bool = True,
+                      file_sha1: Optional[str] = None) -> Tuple[List[Document], int]:
+    """
+    Pasos 1-7 del pipeline para un PDF (CPU puro, sin red ni base de datos):
+    extracción, limpieza, metadatos, unidades, secciones, chunking y tablas.
+    
+    Es una función de módulo para poder ejecutarse en el pool de procesos; con
+    parallel=False el PDF se extrae en serie dentro del worker (sin anidar pools).
+    file_sha1 se guarda en los metadatos para saltar el PDF en ingestas siguientes.
+    
+    Returns:
+        (documentos, número de tablas procesadas)
+    """
+    n_tables = 0
+    
+    # 1. Extracción
+    extractor = PDFExtractor(pdf_path, parallel=parallel)
+    text, tables = extractor.extract_all()
+    
+    if len(text) < 50:
+        logger.warning(f"  ⚠️ {os.path.basename(pdf_path)}: texto insuficiente extraído, saltando...")
+        return [], 0
+    
+    # 2. Limpieza
+    text = clean_headers_footers(text)
+    
+    # 3. Extracción de metadatos
+    metadata = extract_metadata(text, os.path.basename(pdf_path))
+    logger.debug(f"  📋 Metadatos: {metadata['codigo_documento']} | ASTM: {metadata['normas_astm']}")
+    # Claves presentes en todos los chunks nuevos (app.py igual usa .get() por filas antiguas)
+    metadata['codigo_documento'] = metadata['codigo_documento'] or 'DOC'
+    metadata['file_sha1'] = file_sha1
+    
+    # 4. Normalización de unidades (dual)
+    normalized_units = normalize_units(text)
+    if normalized_units:
+        logger.debug(f"  🔢 Unidades normalizadas: {len(normalized_units)}")
+        metadata['unidades_normalizadas'] = normalized_units
+    
+    # 5. Segmentación por secciones (las de 2-3 líneas se unen a la siguiente)
+    sections = merge_small_sections(segment_by_sections(text))
+    logger.debug(f"  📑 Secciones detectadas: {[s['seccion'] for s in sections]}")
+    
+    # Metadatos planos para pgvector (sin listas/dicts): se filtran una vez por PDF
+    base_meta = {k: v for k, v in metadata.items()
+                 if isinstance(v, (str, int, float, bool)) or v is None}
+    
+    # 6. Chunking controlado (TEXT_SPLITTER compartido)
+    documents = []
+    
+    # Procesar secciones como chunks
+    logger.debug(f"  🔹 Iniciando chunking de {len(sections)} secciones...")
+    for section_idx, section in enumerate(sections):
+        # Validar que la sección tenga contenido
+        if not section or 'contenido' not in section:
+            logger.warning(f"     ⚠️  Sección {section_idx} sin estructura válida - SKIP")
+            continue
+    
+        contenido = section.get('contenido', '').strip()
+        seccion_nombre = section.get('seccion', 'DESCONOCIDA')
+    
+        if not contenido:
+            logger.debug(f"     ⚠️  Sección '{seccion_nombre}' vacía - SKIP")
+            continue
+    
+        logger.debug(f"     📄 Sección '{seccion_nombre}': {len(contenido)} caracteres")
+    
+        try:
+            section_chunks = TEXT_SPLITTER.split_text(contenido)
+        except Exception as chunk_error:
+            logger.error(f"     ❌ Error en split_text para '{seccion_nombre}': {chunk_error}")
+            continue
+    
+        section_chunks = merge_small_chunks(section_chunks)
+    
+        # Validar que se generaron chunks
+        if not section_chunks:
+            logger.debug(f"        ⚠️  No se generaron chunks para '{seccion_nombre}'")
+            continue
+    
+        logger.debug(f"        ✓ Generados {len(section_chunks)} chunks")
+    
+        for chunk_idx, chunk in enumerate(section_chunks):
+            # Validar que el chunk tenga contenido útil (no gastar embeddings en ruido)
+            if not is_embeddable_chunk(chunk):
+                logger.debug(f"           ⚠️  Chunk {chunk_idx} vacío o sin texto útil - SKIP")
+                continue
+    
+            doc_metadata = {
+                **base_meta,
+                'seccion': seccion_nombre,
+                'chunk_idx': chunk_idx,
+                'tipo_contenido': 'texto'
+            }
+    
+            documents.append(Document(
+                page_content=chunk,
+                metadata=doc_metadata
+            ))
+    
+    # 7. Procesar tablas (como chunks únicos)
+    logger.debug(f"  🔹 Procesando {len(tables)} tablas...")
+    try:
+        processed_tables = process_tables(tables)
+        for table_data in processed_tables:
+            if not table_data or 'contenido' not in table_data:
+                logger.debug(f"     ⚠️  Tabla sin contenido - SKIP")
+                continue
+    
+            table_metadata = {
+                **base_meta,
+                'seccion': 'TABLAS',
+                'tipo_contenido': 'tabla',
+                'tabla_idx': table_data['tabla_idx'],
+                'page': table_data.get('page')
+            }
+    
+            documents.append(Document(
+                page_content=table_data['contenido'],
+                metadata=table_metadata
+            ))
+    
+        n_tables = len(processed_tables)
+        logger.debug(f"     ✓ {len(processed_tables)} tablas procesadas")
+    
+    except Exception as table_error:
+        logger.error(f"  ❌ Error procesando tablas: {table_error}")
+        import traceback
+        logger.error(traceback.format_exc())
+    
+    return documents, n_tables
+
+
+def _extract_and_chunk_safe(pdf_path: str, parallel: bool = True,
+                            file_sha1: Optional[str] = None) -> Tuple[List[Document], int]:
+    """extract_and_chunk que registra el error y devuelve ([], 0): un PDF roto no corta el map."""
+    try:
+        return extract_and_chunk(pdf_path, parallel, file_sha1)
     except Exception as e:
-        logger.error(f"❌ Error limpiando colección: {e}")
+        import traceback
+        logger.error(f"  ❌ Error procesando {os.path.basename(pdf_path)}: {e}")
+        logger.error(f"  📍 Traceback completo:")
+        logger.error(traceback.format_exc())
+        return [], 0
 
 
-def ingest_pdfs(test_mode: bool = False, test_files: Optional[List[str]] = None, reset: bool = False):
+def ingest_pdfs(test_mode: bool = False, test_files: Optional[List[str]] = None, reset: bool = False,
+                drop_hnsw: bool = True):
     """
     Pipeline completo de ingesta:
     1. Extraer texto y tablas (multi-librería)
@@ -530,6 +1529,8 @@ def ingest_pdfs(test_mode: bool = False, test_files: Optional[List[str]] = None,
         test_mode: Si True, procesa solo archivos de test
         test_files: Lista de patrones de archivos para modo test
         reset: Si True, borra toda la colección antes de ingestar
+        drop_hnsw: Si False, nunca elimina el HNSW durante la carga (ingesta lanzada desde
+            la app: las búsquedas en vivo no pasan a scan secuencial)
     """
     logger.info("=" * 80)
     logger.info("🚀 INICIANDO INGESTA - RAG LABIA")
@@ -541,14 +1542,16 @@ def ingest_pdfs(test_mode: bool = False, test_files: Optional[List[str]] = None,
     # Limpiar colección si se solicita
     if reset:
         reset_vectorstore()
+        database.bump_corpus_version(COLLECTION_NAME)
     
     # Obtener lista de PDFs
     pdf_files = []
     if test_mode and test_files:
         for pattern in test_files:
             pdf_files.extend(glob.glob(os.path.join(RAW_DIRECTORY, pattern)))
-    else:
-        pdf_files = glob.glob(os.path.join(RAW_DIRECTORY, "*.pdf"))
+    elif os.path.isdir(RAW_DIRECTORY):
+        pdf_files = [entry.path for entry in os.scandir(RAW_DIRECTORY)
+                     if entry.name.endswith('.pdf') and entry.is_file()]
     
     if not pdf_files:
         logger.error(f"❌ No se encontraron PDFs en {RAW_DIRECTORY}")
@@ -561,170 +1564,139 @@ def ingest_pdfs(test_mode: bool = False, test_files: Optional[List[str]] = None,
     # Inicializar embeddings
     logger.info("🔗 Conectando a Google Gemini...")
     
-    # Configurar cliente httpx con DNS explícito (bypass DNS interno de Docker)
-    import httpx
-    httpx_client = httpx.Client(
-        verify=False,  # Bypass SSL corporate proxy
-        timeout=120.0,  # Timeout extendido para embeddings
-        follow_redirects=True
-    )
-    
-    embeddings = GoogleGenerativeAIEmbeddings(
+    # Embeddings por lotes en paralelo (REST batchEmbedContents, HTTP/2)
+    embeddings = AsyncBatchEmbedder(
         model="models/embedding-001",
-        google_api_key=os.getenv("GOOGLE_API_KEY"),
-        transport="rest",  # Forzar REST (no gRPC)
-        client_options={"api_endpoint": "https://generativelanguage.googleapis.com"},
-        client=httpx_client  # Cliente customizado con bypass SSL
+        api_key=os.getenv("GOOGLE_API_KEY")
     )
     
-    # Inicializar vectorstore
-    vectorstore = PGVector(
+    # Inicializar vectorstore (crea extensión, tablas y colección si no existen;
+    # la carga en sí va por COPY / execute_values en store_documents)
+    PGVector(
         connection=PG_CONNECTION_STRING,
         collection_name=COLLECTION_NAME,
-        embeddings=embeddings
+        embeddings=embeddings,
+        embedding_length=database.EMBEDDING_DIMENSIONS
     )
     
+    # Saltar PDFs ya ingestados (mismo SHA-1); los modificados reemplazan sus chunks viejos
+    pdf_hashes = {pdf_path: _file_sha1(pdf_path) for pdf_path in pdf_files}
+    existing_hashes = set() if reset else ingested_hashes()
+    skipped = [p for p in pdf_files if pdf_hashes[p] in existing_hashes]
+    pdf_files = [p for p in pdf_files if pdf_hashes[p] not in existing_hashes]
+    if skipped:
+        logger.info(f"⏭️  {len(skipped)} PDFs sin cambios (ya ingestados), se omiten")
+    if not pdf_files:
+        logger.info("✅ No hay PDFs nuevos o modificados para ingestar")
+        return
+    if not reset:
+        deleted = delete_documents_by_source([os.path.basename(p) for p in pdf_files])
+        if deleted:
+            logger.info(f"🗑️  Eliminados {deleted} chunks de versiones anteriores")
+    
     # Procesar cada PDF
     total_chunks = 0
     total_tables = 0
     
-    for pdf_idx, pdf_path in enumerate(pdf_files, 1):
-        logger.info(f"\n{'=' * 80}")
-        logger.info(f"📄 [{pdf_idx}/{len(pdf_files)}] {os.path.basename(pdf_path)}")
-        logger.info(f"{'=' * 80}")
-        
+    # Carga masiva: sin índice HNSW durante el COPY. Se reconstruye en el finally,
+    # así aunque la carga falle la tabla vuelve a quedar indexada.
+    if drop_hnsw and (reset or len(pdf_files) >= HNSW_REBUILD_MIN_PDFS):
+        database.drop_embedding_hnsw_index()
+    
+    # Chunks acumulados entre PDFs: se embeben y cargan en lotes de INGEST_FLUSH_SIZE.
+    # Cada lote se guarda en un hilo aparte mientras este hilo sigue recibiendo (o
+    # extrayendo) PDFs: la espera de red de Gemini se solapa con el trabajo de CPU.
+    # Como máximo un lote en vuelo, para acotar memoria y respetar la cuota.
+    # El executor y el lote en vuelo se cierran en el finally, también si algo falla.
+    pending_docs: List[Document] = []
+    store_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-store")
+    in_flight = None  # (documentos, Future) del lote que se está guardando
+    failed_sources = set()
+    
+    def wait_in_flight():
+        nonlocal total_chunks, in_flight
+        if in_flight is None:
+            return
+        batch, future = in_flight
+        in_flight = None
         try:
-            # 1. Extracción
-            extractor = PDFExtractor(pdf_path)
-            text, tables = extractor.extract_all()
-            
-            if len(text) < 50:
-                logger.warning(f"  ⚠️ Texto insuficiente extraído, saltando...")
-                continue
-            
-            # 2. Limpieza
-            text = clean_headers_footers(text)
-            
-            # 3. Extracción de metadatos
-            metadata = extract_metadata(text, os.path.basename(pdf_path))
-            logger.info(f"  📋 Metadatos: {metadata['codigo_documento']} | ASTM: {metadata['normas_astm']}")
-            
-            # 4. Normalización de unidades (dual)
-            normalized_units = normalize_units(text)
-            if normalized_units:
-                logger.info(f"  🔢 Unidades normalizadas: {len(normalized_units)}")
-                metadata['unidades_normalizadas'] = normalized_units
-            
-            # 5. Segmentación por secciones
-            sections = segment_by_sections(text)
-            logger.info(f"  📑 Secciones detectadas: {[s['seccion'] for s in sections]}")
-            
-            # 6. Chunking controlado
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=CHUNK_SIZE,
-                chunk_overlap=CHUNK_OVERLAP,
-                length_function=len,
-                separators=["\n\n", "\n", ". ", " ", ""],
-                keep_separator=True
-            )
-            
-            documents = []
-            
-            # Procesar secciones como chunks
-            logger.info(f"  🔹 Iniciando chunking de {len(sections)} secciones...")
-            for section_idx, section in enumerate(sections):
-                # Validar que la sección tenga contenido
-                if not section or 'contenido' not in section:
-                    logger.warning(f"     ⚠️  Sección {section_idx} sin estructura válida - SKIP")
-                    continue
-                
-                contenido = section.get('contenido', '').strip()
-                seccion_nombre = section.get('seccion', 'DESCONOCIDA')
-                
-                if not contenido:
-                    logger.warning(f"     ⚠️  Sección '{seccion_nombre}' vacía - SKIP")
-                    continue
-                
-                logger.info(f"     📄 Sección '{seccion_nombre}': {len(contenido)} caracteres")
-                
-                try:
-                    section_chunks = text_splitter.split_text(contenido)
-                except Exception as chunk_error:
-                    logger.error(f"     ❌ Error en split_text para '{seccion_nombre}': {chunk_error}")
-                    continue
-                
-                # Validar que se generaron chunks
-                if not section_chunks:
-                    logger.warning(f"        ⚠️  No se generaron chunks para '{seccion_nombre}'")
-                    continue
-                
-                logger.info(f"        ✓ Generados {len(section_chunks)} chunks")
-                    
-                for chunk_idx, chunk in enumerate(section_chunks):
-                    # Validar que el chunk tenga contenido
-                    if not chunk or not chunk.strip():
-                        logger.warning(f"           ⚠️  Chunk {chunk_idx} vacío - SKIP")
-                        continue
-                        
-                    doc_metadata = {
-                        **metadata,
-                        'seccion': seccion_nombre,
-                        'chunk_idx': chunk_idx,
-                        'tipo_contenido': 'texto'
-                    }
-                    # Limpiar metadatos complejos para pgvector
-                    doc_metadata = {k: v for k, v in doc_metadata.items() 
-                                  if isinstance(v, (str, int, float, bool)) or v is None}
-                    
-                    documents.append(Document(
-                        page_content=chunk,
-                        metadata=doc_metadata
-                    ))
-            
-            # 7. Procesar tablas (como chunks únicos)
-            logger.info(f"  🔹 Procesando {len(tables)} tablas...")
-            try:
-                processed_tables = process_tables(tables)
-                for table_data in processed_tables:
-                    if not table_data or 'contenido' not in table_data:
-                        logger.warning(f"     ⚠️  Tabla sin contenido - SKIP")
-                        continue
-                    
-                    table_metadata = {
-                        **metadata,
-                        'tipo_contenido': 'tabla',
-                        'tabla_idx': table_data['tabla_idx'],
-                        'page': table_data.get('page')
-                    }
-                    table_metadata = {k: v for k, v in table_metadata.items() 
-                                    if isinstance(v, (str, int, float, bool)) or v is None}
-                    
-                    documents.append(Document(
-                        page_content=table_data['contenido'],
-                        metadata=table_metadata
-                    ))
-                
-                total_tables += len(processed_tables)
-                logger.info(f"     ✓ {len(processed_tables)} tablas procesadas")
-                
-            except Exception as table_error:
-                logger.error(f"  ❌ Error procesando tablas: {table_error}")
-                import traceback
-                logger.error(traceback.format_exc())
-            
-            # 8. Generar embeddings y almacenar
-            if documents:
-                logger.info(f"  💾 Generando embeddings para {len(documents)} chunks...")
-                vectorstore.add_documents(documents)
-                total_chunks += len(documents)
-                logger.info(f"  ✅ Almacenados {len(documents)} chunks ({len(processed_tables)} tablas)")
-            
+            stored = future.result()
+            total_chunks += stored
+            logger.info(f"  ✅ Almacenados {stored} chunks")
         except Exception as e:
             import traceback
-            logger.error(f"  ❌ Error procesando {os.path.basename(pdf_path)}: {e}")
-            logger.error(f"  📍 Traceback completo:")
+            logger.error(f"  ❌ Error almacenando {len(batch)} chunks: {e}")
             logger.error(traceback.format_exc())
-            continue
+            # Un PDF cuenta como ingestado (file_sha1 en la colección) solo con TODOS sus
+            # chunks guardados: se borra lo que haya quedado de estos archivos para que
+            # la próxima ingesta los vuelva a procesar completos
+            sources = {d.metadata['source'] for d in batch}
+            failed_sources.update(sources)
+            try:
+                delete_documents_by_source(sources)
+            except Exception as delete_error:
+                logger.error(f"  ❌ No se pudieron limpiar los chunks parciales: {delete_error}")
+    
+    def flush_pending():
+        nonlocal in_flight
+        if not pending_docs:
+            return
+        wait_in_flight()
+        batch = list(pending_docs)
+        pending_docs.clear()
+        logger.info(f"  💾 Generando embeddings para {len(batch)} chunks...")
+        in_flight = (batch, store_executor.submit(store_documents, batch, embeddings))
+    
+    try:
+        # Varios PDFs: uno por worker del pool (extracción en serie dentro de cada uno).
+        # Un solo PDF: se procesa aquí y reparte sus páginas entre los workers.
+        # Embeddings y carga quedan en el proceso principal (cuota de la API).
+        # Con el pool, los resultados se consumen en orden de llegada (as_completed): un PDF
+        # grande no retiene los chunks ya listos de los demás ni retrasa sus flushes.
+        if len(pdf_files) > 1 and PDF_WORKERS > 1:
+            pool = _get_page_pool()
+            futures = {
+                pool.submit(_extract_and_chunk_safe, p, False, pdf_hashes[p]): p for p in pdf_files
+            }
+            progress = ((futures[future], future.result()) for future in as_completed(futures))
+        else:
+            progress = ((p, _extract_and_chunk_safe(p, True, pdf_hashes[p])) for p in pdf_files)
+        
+        if TQDM_AVAILABLE:
+            progress = tqdm(progress, total=len(pdf_files), unit='pdf', desc='Ingesta')
+        
+        for pdf_idx, (pdf_path, (documents, n_tables)) in enumerate(progress, 1):
+            logger.info(f"📄 [{pdf_idx}/{len(pdf_files)}] {os.path.basename(pdf_path)}: "
+                        f"{len(documents)} chunks ({n_tables} tablas)")
+            total_tables += n_tables
+            
+            # 8. Acumular para embeddings + almacenamiento por lotes (entre PDFs).
+            # Se vacía solo entre PDFs: los chunks de un PDF siempre viajan en el mismo lote
+            if documents:
+                pending_docs.extend(documents)
+                if len(pending_docs) >= INGEST_FLUSH_SIZE:
+                    flush_pending()
+        
+        # Resto de chunks que no completaron un lote
+        flush_pending()
+        wait_in_flight()
+        if failed_sources:
+            logger.warning(f"⚠️  {len(failed_sources)} PDFs no se guardaron y se reintentarán en la "
+                           f"próxima ingesta: {', '.join(sorted(failed_sources))}")
+    finally:
+        # Primero el lote en vuelo: usa el embedder y la conexión COPY que se cierran abajo
+        wait_in_flight()
+        store_executor.shutdown(wait=True)
+        shutdown_page_pool()
+        embeddings.close()
+        if COPY_AVAILABLE:
+            close_copy_connection()
+        # Invalida los cachés de retrieval de app.py (todos los workers)
+        database.bump_corpus_version(COLLECTION_NAME)
+        # Índices (HNSW) después de la carga masiva: construirlo una vez sobre todos los
+        # datos es más rápido que mantenerlo fila por fila durante el COPY. Si falla, el
+        # error se propaga (la ingesta no se da por completada con la tabla sin índice)
+        database.ensure_embedding_indexes()
     
     # Resumen final
     logger.info("\n" + "=" * 80)
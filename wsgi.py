@@ -0,0 +1,18 @@
+"""
+================================================================================================
+WSGI.PY - RAG LABIA
+Punto de entrada WSGI para servir la aplicación en producción con gunicorn
+================================================================================================
+
+Uso:
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+El servidor de desarrollo de Werkzeug (python app.py) atiende un request a la vez;
+gunicorn con workers gthread permite que /chat y /metrics se atiendan en paralelo
+mientras otro request espera la respuesta de Gemini.
+================================================================================================
+"""
+
+from app import app
+
+application = app